@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DjangoAir.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402  settings are configured by get_asgi_application
+
+if settings.DEBUG:
+    # uvicorn has no static file handler of its own, in production nginx serves them
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+
+    application = ASGIStaticFilesHandler(application)
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 import os
 from pathlib import Path
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -42,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'users.apps.UsersConfig',
     'customer_interface.apps.CustomerInterfaceConfig',
     'social_django',
@@ -159,10 +162,10 @@ LOGIN_URL = 'users:login'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-EMAIL_USE_TLS = True
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'True') == 'True'
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 
@@ -170,6 +173,12 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 SERVER_EMAIL = EMAIL_HOST_USER
 EMAIL_ADMIN = EMAIL_HOST_USER
 
+# Outbound mail queue: messages per second, burst size, messages per batch and delivery attempts
+EMAIL_RATE_PER_SECOND = float(os.environ.get('EMAIL_RATE_PER_SECOND', 5))
+EMAIL_BURST = int(os.environ.get('EMAIL_BURST', 20))
+EMAIL_BATCH_SIZE = 100
+EMAIL_MAX_ATTEMPTS = 5
+
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
     'social_core.backends.google.GoogleOAuth2',
@@ -198,6 +207,61 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_TASK_ROUTES = {
+    'customer_interface.tasks.flush_outbound_email': {'queue': 'mail'},
+}
+CELERY_BEAT_SCHEDULE = {
+    'expire-ticket-holds': {
+        'task': 'customer_interface.tasks.expire_holds',
+        'schedule': 10.0,
+    },
+    'sweep-expired-tickets': {
+        'task': 'customer_interface.tasks.sweep_expired_tickets',
+        'schedule': 60.0,
+    },
+    'flush-outbound-email': {
+        'task': 'customer_interface.tasks.flush_outbound_email',
+        'schedule': 30.0,
+    },
+    'release-stale-invoice-requests': {
+        'task': 'customer_interface.tasks.release_stale_invoice_requests',
+        'schedule': 300.0,
+    },
+    'reconcile-payments': {
+        'task': 'customer_interface.tasks.reconcile_payments',
+        'schedule': 300.0,
+    },
+    'prune-ticket-documents': {
+        'task': 'customer_interface.tasks.prune_ticket_documents',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'rebuild-seat-inventory': {
+        'task': 'customer_interface.tasks.rebuild_seat_inventory',
+        'schedule': crontab(hour=3, minute=0),
+    },
+}
+
+# Generated ticket PDFs, stored under the hash of their content. The web, worker and mail containers share this
+# directory (the ticket_documents volume of docker-compose), the mail worker attaches what the worker wrote
+TICKET_DOCUMENTS_ROOT = os.environ.get('TICKET_DOCUMENTS_ROOT', BASE_DIR / 'ticket_documents')
+# Documents unused for this long are pruned, unless a queued email still attaches them
+TICKET_DOCUMENTS_MAX_AGE = 7 * 24 * 60 * 60
+
+# How long a booked ticket keeps its seat before it becomes available again
+TICKET_HOLD_SECONDS = 60
+
+WAYFORPAY_API = os.environ.get('WAYFORPAY_API', 'https://api.wayforpay.com/api')
+WAYFORPAY_SERVICE_URL = os.environ.get('WAYFORPAY_SERVICE_URL', 'http://34.70.195.173/api/v1/wayforpay_callback/')
+# Connect and read timeouts in seconds, and how many times a failed gateway request is repeated
+WAYFORPAY_TIMEOUT = (3.05, float(os.environ.get('WAYFORPAY_READ_TIMEOUT', 15)))
+WAYFORPAY_RETRIES = int(os.environ.get('WAYFORPAY_RETRIES', 3))
+# Invoices older than this without a callback are checked with the gateway status API by that many threads
+WAYFORPAY_RECONCILE_AFTER_SECONDS = 120
+WAYFORPAY_RECONCILE_WORKERS = 8
+WAYFORPAY_RECONCILE_LOCK_SECONDS = 600
+# An order still pending this long after the purchase click lost its invoice request and can be bought again
+WAYFORPAY_PENDING_TIMEOUT_SECONDS = 600
 
 CACHES = {
     "default": {
@@ -211,6 +275,12 @@ CACHES = {
 
 CELERY_CACHE_BACKEND = 'default'
 
+# Counter changes reach the live flight dashboards over Redis pub/sub
+LIVE_EVENTS_REDIS_URL = os.environ.get("REDIS_LOCATION")
+LIVE_EVENTS_KEEPALIVE_SECONDS = 15
+LIVE_EVENTS_STREAM_SECONDS = 300
+LIVE_EVENTS_QUEUE_SIZE = 100
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
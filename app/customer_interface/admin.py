@@ -1,12 +1,15 @@
 from django.contrib import admin
 
-from .models import Airplane, Flight, Ticket, Order, Facilities, FlightFacilities, TicketFacilities
+from .models import Airplane, Flight, Ticket, Order, Facilities, FlightFacilities, TicketFacilities, SeatInventory, \
+    OutboundEmail
 
 admin.site.register(Airplane)
 admin.site.register(Order)
 admin.site.register(Facilities)
 admin.site.register(FlightFacilities)
 admin.site.register(TicketFacilities)
+admin.site.register(SeatInventory)
+admin.site.register(OutboundEmail)
 
 
 class FlightFacilitiesInline(admin.TabularInline):
@@ -24,7 +24,7 @@ class SearchFlightForm(forms.Form):
         required=False,
         label="",
         widget=forms.TextInput(
-            attrs={"placeholder": "Search by place of departure"}
+            attrs={"placeholder": "Search by place of departure", "list": "airports"}
         )
     )
     place_of_arrival = forms.CharField(
@@ -32,7 +32,21 @@ class SearchFlightForm(forms.Form):
         required=False,
         label="",
         widget=forms.TextInput(
-            attrs={"placeholder": "Search by place of arrival"}
+            attrs={"placeholder": "Search by place of arrival", "list": "airports"}
+        )
+    )
+    date_from = forms.DateField(
+        required=False,
+        label="",
+        widget=forms.DateInput(
+            attrs={"type": "date", "title": "Departure from"}
+        )
+    )
+    date_to = forms.DateField(
+        required=False,
+        label="",
+        widget=forms.DateInput(
+            attrs={"type": "date", "title": "Departure to"}
         )
     )
 
@@ -0,0 +1,263 @@
+import email
+import json
+import re
+import socketserver
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from customer_interface.models import Airplane, Basket, Flight, Order, SeatInventory, Ticket
+
+PASSWORD = 'load-test-password'
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Minimal SMTP server that accepts every message and counts the attachments it delivers."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, SmtpSinkHandler)
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.attachments = Counter()
+
+    def record(self, data):
+        message = email.message_from_bytes(data)
+        names = [part.get_filename() for part in message.walk() if part.get_filename()]
+        with self.lock:
+            self.messages += 1
+            self.attachments.update(names)
+
+
+class SmtpSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode('utf-8'))
+
+    def handle(self):
+        self.reply('220 smtp sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250-smtp sink')
+                self.reply('250 AUTH PLAIN LOGIN')
+            elif command.startswith('AUTH'):
+                self.reply('235 Authentication successful')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if chunk in (b'.\r\n', b'.\n', b''):
+                        break
+                    data.append(chunk[1:] if chunk.startswith(b'..') else chunk)
+                self.server.record(b''.join(data))
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(share * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = ('Drives concurrent checkouts (basket, create_order, ticket_customization, buy_order, gateway callback) '
+            'against a running server and reports throughput, latency, oversold seats and duplicate emails')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--tickets', type=int, default=1, help='Tickets every user books')
+        parser.add_argument('--flight', type=int, help='Flight to sell, a new flight is created by default')
+        parser.add_argument('--seats', type=int, default=20, help='Economy seats of the created flight')
+        parser.add_argument('--smtp-port', type=int, default=2525,
+                            help='Port of the SMTP sink, run the worker with EMAIL_HOST=127.0.0.1, '
+                                 'EMAIL_PORT=<port> and EMAIL_USE_TLS=False; 0 disables the sink')
+        parser.add_argument('--settle', type=float, default=30.0,
+                            help='Seconds to wait for payment callbacks and emails after the last checkout')
+
+    def handle(self, *args, **options):
+        flight = self.get_flight(options)
+        users = self.get_users(options['users'])
+        sink = None
+        if options['smtp_port']:
+            sink = SmtpSink(('127.0.0.1', options['smtp_port']))
+            threading.Thread(target=sink.serve_forever, daemon=True).start()
+
+        latencies = defaultdict(list)
+        outcomes = Counter()
+        orders = []
+        lock = threading.Lock()
+
+        def run(user):
+            try:
+                order_id, timings = self.checkout(options['base_url'], user, flight, options['tickets'])
+            except Exception as error:
+                with lock:
+                    outcomes[f'error: {type(error).__name__}'] += 1
+                return
+            finally:
+                connection.close()
+            with lock:
+                for step, seconds in timings.items():
+                    latencies[step].append(seconds)
+                outcomes['ordered' if order_id else 'sold out'] += 1
+                if order_id:
+                    orders.append(order_id)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            list(executor.map(run, users))
+        elapsed = time.monotonic() - started
+
+        paid = self.wait_for_payments(orders, options['settle'])
+        if sink:
+            expected_tickets = Ticket.objects.filter(order_id__in=orders, status='checked_out').count()
+            deadline = time.monotonic() + options['settle']
+            while sum(sink.attachments.values()) < expected_tickets and time.monotonic() < deadline:
+                time.sleep(0.5)
+            sink.shutdown()
+
+        report = {
+            'checkouts': len(users),
+            'elapsed_seconds': round(elapsed, 2),
+            'throughput_per_second': round(len(orders) / elapsed, 2) if elapsed else 0,
+            'outcomes': dict(outcomes),
+            'paid_orders': paid,
+            'latency_ms': {
+                step: {
+                    'p50': round(percentile(values, 0.5) * 1000, 1),
+                    'p99': round(percentile(values, 0.99) * 1000, 1),
+                    'mean': round(statistics.fmean(values) * 1000, 1),
+                }
+                for step, values in latencies.items()
+            },
+            'oversell': self.oversell(flight),
+        }
+        if sink:
+            report['emails'] = {
+                'messages': sink.messages,
+                'attachments': sum(sink.attachments.values()),
+                'duplicate_attachments': sum(count - 1 for count in sink.attachments.values() if count > 1),
+            }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def get_flight(self, options):
+        if options['flight']:
+            return Flight.objects.get(pk=options['flight'])
+        airplane = Airplane.objects.create(economy_seats=options['seats'], business_seats=6)
+        departure = timezone.now() + timedelta(days=30)
+        return Flight.objects.create(
+            date_time_of_departure=departure,
+            date_time_of_arrival=departure + timedelta(hours=2),
+            place_of_departure='Load Test',
+            place_of_arrival='Load Test',
+            airplane=airplane,
+            available_economy_seats=airplane.economy_seats,
+            available_business_seats=airplane.business_seats,
+            price_economy_seats=100,
+            price_business_seats=300,
+        )
+
+    def get_users(self, count):
+        users = []
+        for index in range(count):
+            user, created = get_user_model().objects.get_or_create(email=f'load{index}@example.com')
+            if created:
+                user.set_password(PASSWORD)
+                user.save()
+            else:
+                # The basket of a previous run is emptied so every checkout starts the same way
+                Basket.objects.get(user=user).tickets.clear()
+            users.append(user)
+        return users
+
+    def checkout(self, base_url, user, flight, tickets):
+        """Runs one checkout through the web views and returns the order id and the time spent on every step."""
+        session = requests.Session()
+        timings = {}
+
+        def post(step, path, data):
+            session.cookies.get('csrftoken') or session.get(f'{base_url}{path}')
+            started = time.monotonic()
+            response = session.post(f'{base_url}{path}', data=data, allow_redirects=False,
+                                    headers={'X-CSRFToken': session.cookies.get('csrftoken', ''),
+                                             'Referer': f'{base_url}{path}'})
+            timings[step] = timings.get(step, 0) + time.monotonic() - started
+            if response.status_code >= 500:
+                raise RuntimeError(f'{step} answered {response.status_code}')
+            return response
+
+        post('login', '/users/login/', {'username': user.email, 'password': PASSWORD})
+        for _ in range(tickets):
+            response = post('book', f'/flight/{flight.pk}/', {'add_economy': '1'})
+            if response.status_code != 302:
+                return None, timings
+
+        ticket_ids = Basket.objects.get(user=user).tickets.values_list('id', flat=True)
+        data = {f'ticket_{ticket_id}': 'on' for ticket_id in ticket_ids}
+        response = post('create_order', '/create_order', {**data, 'create_order': '1'})
+        order_id = int(re.search(r'/ticket_customization/(\d+)/', response.headers['Location']).group(1))
+
+        data = {}
+        for ticket_id in Ticket.objects.filter(order_id=order_id).values_list('id', flat=True):
+            data.update({
+                f'first_name_{ticket_id}': 'Load',
+                f'last_name_{ticket_id}': f'Test {user.pk}',
+                f'seat_number_{ticket_id}': '',
+            })
+        post('ticket_customization', f'/ticket_customization/{order_id}/', data)
+        post('buy_order', f'/buy_order/{order_id}/', {})
+        return order_id, timings
+
+    def wait_for_payments(self, orders, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            pending = Order.objects.filter(id__in=orders, payment_status__in=('new', 'pending', 'invoiced'))
+            if not pending.exists() or time.monotonic() > deadline:
+                break
+            time.sleep(0.5)
+        statuses = Order.objects.filter(id__in=orders).values('payment_status').annotate(total=Count('id'))
+        return {row['payment_status']: row['total'] for row in statuses}
+
+    def oversell(self, flight):
+        """Seats given out beyond the capacity of the flight, according to the tickets and to the counters."""
+        tickets = Ticket.objects.filter(flight=flight)
+        result = {}
+        for seat_class in ('economy', 'business'):
+            taken = tickets.filter(seat_class=seat_class).aggregate(
+                held=Count('id', filter=Q(status='booked')),
+                sold=Count('id', filter=Q(status='checked_out')),
+            )
+            capacity = flight.seat_capacity(seat_class)
+            inventory = SeatInventory.objects.filter(flight=flight, seat_class=seat_class).first()
+            result[seat_class] = {
+                'capacity': capacity,
+                'tickets_oversold': max(0, taken['held'] + taken['sold'] - capacity),
+                'counters_oversold': max(0, inventory.held + inventory.sold - capacity) if inventory else 0,
+                'duplicate_seat_numbers': tickets.filter(seat_class=seat_class).exclude(seat_number=None)
+                .values('seat_number').annotate(total=Count('id')).filter(total__gt=1).count(),
+            }
+        return result
@@ -0,0 +1,191 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.core.management.base import BaseCommand
+
+from customer_interface.utils.wayforpay import SECRET_KEY, generate_hmac
+
+
+class FakeWayForPay(ThreadingHTTPServer):
+    """Local stand-in for api.wayforpay.com that creates invoices and pays them with a callback to serviceUrl."""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, failure_rate=0.0, decline_rate=0.0, callback_delay=0.5,
+                 callback_repeats=1, lost_callback_rate=0.0):
+        super().__init__(address, FakeWayForPayHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.decline_rate = decline_rate
+        self.callback_delay = callback_delay
+        self.callback_repeats = callback_repeats
+        self.lost_callback_rate = lost_callback_rate
+        self.invoices = {}
+        self.statuses = {}
+        self.lock = threading.Lock()
+        self.stats = {'invoices': 0, 'failures': 0, 'bad_signatures': 0, 'callbacks': 0, 'callback_errors': 0,
+                      'lost_callbacks': 0, 'status_checks': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def invoice_url(self, order_reference):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/pay/{order_reference}'
+
+    def pay(self, params):
+        """Posts the payment result the way the gateway does, a raw JSON body repeated like gateway retries."""
+        time.sleep(self.callback_delay)
+        declined = random.random() < self.decline_rate
+        payload = {
+            'merchantAccount': params['merchantAccount'],
+            'orderReference': params['orderReference'],
+            'amount': params['amount'],
+            'currency': params['currency'],
+            'authCode': '541963',
+            'cardPan': '41****8217',
+            'transactionStatus': 'Declined' if declined else 'Approved',
+            'reasonCode': 1101 if declined else 1100,
+        }
+        payload['merchantSignature'] = generate_hmac([
+            payload['merchantAccount'], payload['orderReference'], str(payload['amount']), payload['currency'],
+            payload['authCode'], payload['cardPan'], payload['transactionStatus'], str(payload['reasonCode']),
+        ], SECRET_KEY)
+        with self.lock:
+            self.statuses[params['orderReference']] = payload
+
+        if random.random() < self.lost_callback_rate:
+            # The payment went through but the merchant never hears about it, only CHECK_STATUS tells
+            return self.count('lost_callbacks')
+        for _ in range(self.callback_repeats):
+            try:
+                requests.post(params['serviceUrl'], data=json.dumps(payload), timeout=10,
+                              headers={'Content-Type': 'application/x-www-form-urlencoded'})
+                self.count('callbacks')
+            except requests.RequestException:
+                self.count('callback_errors')
+
+
+class FakeWayForPayHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        body = f'<h1>Fake WayForPay invoice {self.path.rsplit("/", 1)[-1]}</h1>'.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        params = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(random.expovariate(1 / server.latency) if server.latency else 0)
+
+        if random.random() < server.failure_rate:
+            server.count('failures')
+            return self.send_json(503, {'reason': 'Service unavailable'}, {'Retry-After': '1'})
+
+        if params.get('transactionType') == 'CHECK_STATUS':
+            return self.check_status(params)
+        if params.get('transactionType') != 'CREATE_INVOICE':
+            return self.send_json(200, {'reason': 'Unknown transactionType', 'reasonCode': 1120})
+
+        expected = generate_hmac(
+            [params['merchantAccount'], params['merchantDomainName'], params['orderReference'],
+             str(params['orderDate']), str(params['amount']), params['currency']]
+            + list(params['productName'])
+            + [str(count) for count in params['productCount']]
+            + [str(price) for price in params['productPrice']],
+            SECRET_KEY,
+        )
+        if expected != params.get('merchantSignature'):
+            server.count('bad_signatures')
+            return self.send_json(200, {'reason': 'Invalid signature', 'reasonCode': 1113})
+
+        order_reference = params['orderReference']
+        with server.lock:
+            created = order_reference not in server.invoices
+            server.invoices[order_reference] = params
+        if created:
+            server.count('invoices')
+            threading.Thread(target=server.pay, args=(params,), daemon=True).start()
+        self.send_json(200, {
+            'reason': 'Ok',
+            'reasonCode': 1100,
+            'invoiceUrl': server.invoice_url(order_reference),
+        })
+
+    def check_status(self, params):
+        server = self.server
+        server.count('status_checks')
+        if generate_hmac([params['merchantAccount'], params['orderReference']], SECRET_KEY) \
+                != params.get('merchantSignature'):
+            server.count('bad_signatures')
+            return self.send_json(200, {'reason': 'Invalid signature', 'reasonCode': 1113})
+
+        with server.lock:
+            payment = server.statuses.get(params['orderReference'])
+            invoiced = params['orderReference'] in server.invoices
+        if payment:
+            return self.send_json(200, {**payment, 'reason': 'Ok'})
+        if invoiced:
+            return self.send_json(200, {'orderReference': params['orderReference'], 'transactionStatus': 'Pending',
+                                        'reason': 'Ok', 'reasonCode': 1100})
+        return self.send_json(200, {'orderReference': params['orderReference'], 'reason': 'Order not found',
+                                    'reasonCode': 1114})
+
+
+class Command(BaseCommand):
+    help = 'Runs a local WayForPay stand-in, point WAYFORPAY_API at it to exercise checkout without the gateway'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Mean response time of the gateway in seconds')
+        parser.add_argument('--failure-rate', type=float, default=0.0,
+                            help='Share of invoice requests answered with HTTP 503')
+        parser.add_argument('--decline-rate', type=float, default=0.0,
+                            help='Share of invoices paid with a declined callback')
+        parser.add_argument('--callback-delay', type=float, default=0.5,
+                            help='Seconds between the invoice and its payment callback')
+        parser.add_argument('--callback-repeats', type=int, default=1,
+                            help='How many times every callback is delivered')
+        parser.add_argument('--lost-callback-rate', type=float, default=0.0,
+                            help='Share of payments whose callback is never delivered')
+
+    def handle(self, *args, **options):
+        server = FakeWayForPay(
+            (options['host'], options['port']),
+            latency=options['latency'],
+            failure_rate=options['failure_rate'],
+            decline_rate=options['decline_rate'],
+            callback_delay=options['callback_delay'],
+            callback_repeats=options['callback_repeats'],
+            lost_callback_rate=options['lost_callback_rate'],
+        )
+        self.stdout.write(f'Fake WayForPay is listening on http://{options["host"]}:{options["port"]}/api')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(json.dumps(server.stats))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from customer_interface.models import Flight
+from customer_interface.utils.inventory import rebuild_inventory
+
+
+class Command(BaseCommand):
+    help = 'Recounts the seat counters, flight statistics and seat maps of flights from the ticket table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('flight_ids', nargs='*', type=int, help='Flights to rebuild, all flights by default')
+
+    def handle(self, *args, **options):
+        flights = Flight.objects.all()
+        if options['flight_ids']:
+            flights = flights.filter(pk__in=options['flight_ids'])
+
+        rebuilt = 0
+        for flight in flights.iterator():
+            rebuild_inventory(flight)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt seat inventory of {rebuilt} flights'))
@@ -1,11 +1,10 @@
-from datetime import timedelta
-
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from customer_interface.validators import create_ticket_validator, update_ticket_validator
 
@@ -55,12 +54,53 @@ class Flight(models.Model):
     def __str__(self):
         return f"Flight from {self.place_of_departure} to {self.place_of_arrival} at {self.date_time_of_departure}"
 
+    class Meta:
+        indexes = [
+            GinIndex(SearchVector('place_of_departure', config='simple'), name='flight_departure_search_idx'),
+            GinIndex(SearchVector('place_of_arrival', config='simple'), name='flight_arrival_search_idx'),
+            models.Index(fields=['date_time_of_departure'], name='flight_departure_time_idx'),
+        ]
+
     def clean(self):
         if not self.pk:  # check if object is being created
             self.available_economy_seats = self.airplane.economy_seats
             self.available_business_seats = self.airplane.business_seats
         super().clean()
 
+    def seat_capacity(self, seat_class):
+        return self.available_economy_seats if seat_class == 'economy' else self.available_business_seats
+
+
+class SeatInventory(models.Model):
+    flight = models.ForeignKey(Flight, on_delete=models.CASCADE, related_name='seat_inventory')
+    seat_class = models.CharField(max_length=10, choices=[('economy', _('Economy')), ('business', _('Business'))])
+    capacity = models.IntegerField(default=0)
+    held = models.IntegerField(default=0)
+    sold = models.IntegerField(default=0)
+    checked_in = models.IntegerField(default=0)
+    boarded = models.IntegerField(default=0)
+    seat_map = models.BinaryField(default=b'')
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"Flight {self.flight_id} {self.seat_class}: {self.sold} sold, {self.held} held of {self.capacity}"
+
+    @property
+    def remaining(self):
+        return self.capacity - self.held - self.sold
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['flight', 'seat_class'], name='unique_flight_seat_class')
+        ]
+
+
+@receiver([post_save, post_delete], sender=Flight)
+def reset_airports(sender, instance, **kwargs):
+    from .utils.flight_search import reset_airports_cache
+    reset_airports_cache()
+
 
 class FlightFacilities(models.Model):
     facilities = models.ForeignKey(Facilities, on_delete=models.CASCADE)
@@ -87,17 +127,34 @@ class Basket(models.Model):
 
 
 class Order(models.Model):
+    PAYMENT_STATUS_CHOICES = (
+        ('new', 'New'),
+        ('pending', 'Pending'),
+        ('invoiced', 'Invoiced'),
+        ('failed', 'Failed'),
+        ('paid', 'Paid'),
+        # Paid with another sum than the order price, or after its seats were sold, the payment is returned by hand
+        ('refund', 'Refund required'),
+    )
+
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
     created_order = models.DateTimeField(auto_now_add=True)
-    price = models.IntegerField(blank=True, default=0)
+    price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, default=0)
+    payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='new')
+    invoice_url = models.URLField(max_length=500, blank=True, default='')
+    # When the order became pending, a request that never finished is reset by release_stale_invoice_requests
+    payment_requested_at = models.DateTimeField(null=True, blank=True, default=None)
 
     objects = models.Manager()
 
 
 class FacilitiesOrder(models.Model):
-    ticket = models.ForeignKey('Ticket', on_delete=models.CASCADE)
+    # A desk check-in of several tickets is charged once per order the tickets belong to
+    ticket = models.ForeignKey('Ticket', on_delete=models.CASCADE, null=True, default=None)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, default=None,
+                              related_name='facilities_orders')
     created_order = models.DateTimeField(auto_now_add=True)
-    price = models.IntegerField(blank=True, default=0)
+    price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, default=0)
 
     objects = models.Manager()
 
@@ -127,6 +184,11 @@ class Ticket(models.Model):
 
     objects = models.Manager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='ticket_status_created_idx'),
+        ]
+
     def clean(self):
         if self._state.adding:
             create_ticket_validator(self.seat_class, self.seat_number, self.flight, Ticket)
@@ -134,17 +196,10 @@ class Ticket(models.Model):
             update_ticket_validator(self.seat_class, self.seat_number, self.flight, Ticket)
 
 
-@receiver(post_save, sender=Ticket)
-def schedule_deletion(sender, instance, created, **kwargs):
-    from .tasks import available_ticket
-    if instance.status == 'booked':
-        # If the object is created for the first time and the created flag is True, schedule a deletion task.
-        if created:
-            available_ticket.apply_async(args=[instance.id], countdown=60)  # Schedule a task 60 seconds after saving.
-        else:
-            # If the object has been modified, check if more than 1 minute has passed since it was created.
-            if timezone.now() - instance.created_at > timedelta(minutes=1):
-                available_ticket.apply_async(args=[instance.id])
+@receiver(post_delete, sender=Ticket)
+def release_inventory(sender, instance, **kwargs):
+    from .utils.inventory import release_ticket
+    release_ticket(instance)
 
 
 class TicketFacilities(models.Model):
@@ -155,3 +210,34 @@ class TicketFacilities(models.Model):
 
     def __str__(self):
         return f"{self.flight_facilities}"
+
+
+class OutboundEmail(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    content_subtype = models.CharField(max_length=10, default='plain')
+    to = models.JSONField(default=list)
+    attachment_name = models.CharField(max_length=255, blank=True, default='')
+    attachment_document = models.CharField(max_length=255, blank=True, default='')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(auto_now_add=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, default=None)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)}: {self.status}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due_idx'),
+        ]
@@ -6,3 +6,13 @@ class WayForPayCallbackSerializer(serializers.Serializer):
     reasonCode = serializers.CharField()
     time = serializers.CharField()
     signature = serializers.CharField()
+
+
+class GateScanSerializer(serializers.Serializer):
+    code = serializers.CharField(max_length=64)
+    # Set by a scanner replaying the scans it queued while offline
+    scanned_at = serializers.DateTimeField(required=False)
+
+
+class GateBatchSerializer(serializers.Serializer):
+    scans = GateScanSerializer(many=True, allow_empty=False, max_length=500)
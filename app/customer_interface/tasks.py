@@ -1,24 +1,272 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
 from celery import shared_task
-from django.core.exceptions import ObjectDoesNotExist
-from django.utils.timezone import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
-from customer_interface.models import Ticket
-from customer_interface.utils.send_tickets import send_ticket_email
+from customer_interface.models import Ticket, Basket, Order
+from customer_interface.utils.holds import HoldStore
+from customer_interface.utils.inventory import reserve_seat, shift_for_tickets
+from customer_interface.utils.mail_queue import FLUSH_QUEUED_KEY, flush_outbox
+from customer_interface.utils.pricing import quote_order
+from customer_interface.utils.send_tickets import send_tickets_email
+from customer_interface.utils.ticket_documents import prune_documents
+from customer_interface.utils.wayforpay import create_request_params, create_status_params, send_request, \
+    handle_response, gateway_amount
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_LOCK = 'customer_interface:reconcile_payments'
+
+
+def _expire_tickets(ticket_ids):
+    """Makes the still booked tickets among ticket_ids available and tells their carts, in bulk.
+
+    The tickets stay in their carts and orders: book_ticket gives such a seat to the next buyer and tells the cart
+    owner, and an order that is still completed holds its seats again.
+    """
+    with transaction.atomic():
+        expired_ids = list(Ticket.objects.select_for_update().filter(
+            id__in=ticket_ids, status='booked').values_list('id', flat=True))
+        if not expired_ids:
+            return 0
+        expired_tickets = Ticket.objects.filter(id__in=expired_ids)
+        shift_for_tickets(expired_tickets, held=-1)
+        expired_tickets.update(status='available')
+
+        notices = {}
+        for item in Basket.tickets.through.objects.filter(ticket_id__in=expired_ids).select_related('ticket__flight'):
+            notices.setdefault(item.basket_id, []).append(
+                f'\nThe booking time for Flight: {item.ticket.flight} Seat: {item.ticket.seat_class} has expired, the seat goes to the next buyer unless you place the order.'
+            )
+        baskets = list(Basket.objects.select_for_update().filter(id__in=notices))
+        for basket in baskets:
+            basket.messages += ''.join(notices[basket.id])
+        Basket.objects.bulk_update(baskets, ['messages'])
+
+    HoldStore().release(*expired_ids)
+    return len(expired_ids)
+
+
+@shared_task
+def expire_holds():
+    """Making tickets available again when their hold in the hold store has expired."""
+    ticket_ids = HoldStore().pop_expired()
+    if not ticket_ids:
+        return 0
+    return _expire_tickets(ticket_ids)
+
+
+@shared_task
+def sweep_expired_tickets(batch_size=500):
+    """Expiring every booked ticket older than the hold time, in batches of the created_at index.
+
+    The hold store normally expires tickets first, the sweep catches whatever it missed (e.g. after a Redis restart).
+    """
+    deadline = timezone.now() - timedelta(seconds=settings.TICKET_HOLD_SECONDS)
+    expired = Ticket.objects.filter(status='booked', created_at__lt=deadline).order_by('created_at')
+    processed = 0
+    while True:
+        batch = list(expired.values_list('id', 'created_at')[:batch_size])
+        if not batch:
+            break
+        # Everything up to the newest creation time of the batch is covered by the same index range.
+        upper_bound = batch[-1][1]
+        ticket_ids = expired.filter(created_at__lte=upper_bound).values_list('id', flat=True)
+        processed += _expire_tickets(list(ticket_ids))
+        if len(batch) < batch_size:
+            break
+
+    logger.info('Expired %s booked tickets', processed)
+    return processed
+
+
+@shared_task
+def rebuild_seat_inventory():
+    """Correcting any drift of the incrementally kept flight counters."""
+    call_command('rebuild_seat_inventory')
+
+
+def _delivery_tickets(tickets):
+    return tickets.select_related('flight').prefetch_related('flight_facilities__facilities').order_by('id')
 
 
 @shared_task
-def available_ticket(instance_id):
-    """Deleting a ticket if the time limit has expired."""
+def send_tickets(ticket_ids, email):
+    if isinstance(ticket_ids, int):
+        ticket_ids = [ticket_ids]  # Messages queued with a single ticket id before the tasks took lists
+    send_tickets_email(_delivery_tickets(Ticket.objects.filter(pk__in=ticket_ids)), email)
+
+
+def _rebook_expired_tickets(order_id):
+    """Holds a seat again for every ticket of the order whose hold expired before the payment arrived.
+
+    The seats go through the same conditional UPDATE as a new booking, so a late payment never sells a seat twice.
+    Returns False, with nothing changed, when a seat is gone.
+    """
+    expired = list(Ticket.objects.filter(order_id=order_id, status='available').select_related('flight'))
     try:
-        obj = Ticket.objects.get(id=instance_id)
-        if obj.status == 'booked' and timezone.now() - obj.created_at > timedelta(minutes=1):
-            obj.status = 'available'
-            obj.save()
-    except ObjectDoesNotExist:
-        pass
+        with transaction.atomic():
+            for ticket in expired:
+                reserve_seat(ticket.flight, ticket.seat_class)
+            Ticket.objects.filter(id__in=[ticket.id for ticket in expired]).update(status='booked')
+    except ValidationError:
+        return False
+    return True
+
+
+def settle_paid_orders(order_ids, amounts=None):
+    """Checks out the tickets of the orders the gateway reports as paid, every order is settled only once.
+
+    Marking the order paid is the idempotency gate, so repeated callbacks and status checks of a paid order stop
+    after one indexed lookup. `amounts` are the paid sums the gateway reported per order id, an order paid with
+    another sum than its price, or one that can no longer get its seats, is marked for a refund instead.
+    """
+    amounts = {order_id: amount for order_id, amount in (amounts or {}).items() if amount is not None}
+    with transaction.atomic():
+        prices = dict(Order.objects.select_for_update().filter(id__in=order_ids).exclude(
+            payment_status__in=('paid', 'refund')).values_list('id', 'price'))
+        if not prices:
+            return []
+        # The sweeper locks the tickets only, so it cannot expire one of them between the counting and the update
+        locked = list(Ticket.objects.select_for_update().filter(order_id__in=prices).order_by('id').values_list(
+            'id', 'order_id'))
+        paid_ids = [
+            order_id for order_id, price in sorted(prices.items())
+            if (order_id not in amounts or gateway_amount(amounts[order_id]) == gateway_amount(price))
+            and _rebook_expired_tickets(order_id)
+        ]
+        refund_ids = sorted(set(prices) - set(paid_ids))
+        if refund_ids:
+            Order.objects.filter(id__in=refund_ids).update(payment_status='refund')
+            logger.error('Orders %s were paid with another sum or after their seats were sold, they need a refund',
+                         refund_ids)
+        if not paid_ids:
+            return []
+        Order.objects.filter(id__in=paid_ids).update(payment_status='paid')
+
+        ticket_ids = [ticket_id for ticket_id, order_id in locked if order_id in paid_ids]
+        order_tickets = Ticket.objects.filter(id__in=ticket_ids)
+        shift_for_tickets(order_tickets.filter(status='booked'), held=-1, sold=1)
+        order_tickets.update(status='checked_out')
+
+        transaction.on_commit(lambda: HoldStore().release(*ticket_ids))
+        for order_id in paid_ids:
+            transaction.on_commit(lambda order_id=order_id: send_order_tickets.delay(order_id))
+    return paid_ids
+
+
+@shared_task
+def send_order_tickets(order_id):
+    """Delivers all tickets of a paid order in one email, the tickets are loaded with a single prefetch."""
+    order = Order.objects.select_related('user').get(id=order_id)
+    send_tickets_email(_delivery_tickets(order.tickets.all()), order.user.email)
+
+
+@shared_task
+def create_invoice(order_id):
+    """Asks the gateway for the invoice of a pending order, outside of any web request and DB transaction."""
+    order = Order.objects.select_related('user').get(id=order_id)
+    if order.payment_status != 'pending':
+        return order.payment_status
+
+    quote = quote_order(order)
+    try:
+        result = handle_response(send_request(create_request_params(quote, order.user.email, order_id)))
+    except requests.RequestException:
+        logger.exception('Invoice request for order %s failed', order_id)
+        result = {}
+
+    invoice_url = result.get('invoiceUrl')
+    # The order may have been paid while the request was running, so only a pending order is updated
+    Order.objects.filter(id=order_id, payment_status='pending').update(
+        price=quote['total'],
+        payment_status='invoiced' if invoice_url else 'failed',
+        invoice_url=invoice_url or '',
+    )
+    if not invoice_url:
+        logger.warning('Gateway did not create the invoice for order %s: %s', order_id, result)
+    return 'invoiced' if invoice_url else 'failed'
+
+
+@shared_task
+def release_stale_invoice_requests():
+    """Lets orders whose invoice request was lost be bought again, their create_invoice task never finished."""
+    stale_before = timezone.now() - timedelta(seconds=settings.WAYFORPAY_PENDING_TIMEOUT_SECONDS)
+    released = Order.objects.filter(payment_status='pending').filter(
+        Q(payment_requested_at__lt=stale_before) | Q(payment_requested_at__isnull=True),
+    ).update(payment_status='failed')
+    if released:
+        logger.warning('Released %s orders stuck waiting for an invoice', released)
+    return released
+
+
+def _check_payment(order_id):
+    try:
+        return order_id, handle_response(send_request(create_status_params(order_id)))
+    except requests.RequestException:
+        logger.warning('Status check of order %s failed', order_id, exc_info=True)
+        return order_id, {}
+
+
+@shared_task
+def reconcile_payments(batch_size=100):
+    """Settles invoiced orders whose payment callback never arrived, using the gateway status API.
+
+    Orders are checked in batches by a bounded pool of threads sharing the pooled gateway session, and every batch
+    is settled with set-based updates.
+    """
+    if not cache.add(RECONCILE_LOCK, 1, timeout=settings.WAYFORPAY_RECONCILE_LOCK_SECONDS):
+        return 0  # The previous run is still working through the backlog
+
+    try:
+        invoiced = Order.objects.filter(
+            payment_status='invoiced',
+            created_order__lte=timezone.now() - timedelta(seconds=settings.WAYFORPAY_RECONCILE_AFTER_SECONDS),
+        ).order_by('id')
+        settled = 0
+        last_id = 0
+        with ThreadPoolExecutor(settings.WAYFORPAY_RECONCILE_WORKERS) as executor:
+            while True:
+                order_ids = list(invoiced.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+                if not order_ids:
+                    break
+                last_id = order_ids[-1]
+
+                paid_amounts, failed_ids = {}, []
+                for order_id, result in executor.map(_check_payment, order_ids):
+                    status = result.get('transactionStatus')
+                    if status == 'Approved':
+                        paid_amounts[order_id] = result.get('amount')
+                    elif status in ('Declined', 'Expired', 'Refunded', 'Voided'):
+                        failed_ids.append(order_id)
+
+                settled += len(settle_paid_orders(list(paid_amounts), paid_amounts)) if paid_amounts else 0
+                settled += Order.objects.filter(id__in=failed_ids, payment_status='invoiced').update(
+                    payment_status='failed',
+                )
+        return settled
+    finally:
+        cache.delete(RECONCILE_LOCK)
+
+
+@shared_task
+def flush_outbound_email():
+    """Runs on the dedicated mail queue, see CELERY_TASK_ROUTES."""
+    cache.delete(FLUSH_QUEUED_KEY)
+    return flush_outbox()
 
 
 @shared_task
-def send_tickets(ticket_id, email):
-    ticket = Ticket.objects.get(pk=ticket_id)
-    send_ticket_email(ticket, email)
+def prune_ticket_documents():
+    """Removing the stored ticket PDFs nobody used for a while."""
+    pruned = prune_documents()
+    logger.info('Pruned %s ticket documents', pruned)
+    return pruned
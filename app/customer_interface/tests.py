@@ -1,3 +1,533 @@
-from django.test import TestCase
+import base64
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.exceptions import ValidationError
+from django.db import connection, connections
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Airplane, Basket, Facilities, FacilitiesOrder, Flight, FlightFacilities, Order, OutboundEmail, SeatInventory,
+    Ticket,
+)
+from .tasks import release_stale_invoice_requests, settle_paid_orders, sweep_expired_tickets
+from .utils.availability import bump_availability, cached_availability
+from .utils.boarding import PAYLOAD, TOKEN_PREFIX, make_boarding_token, read_boarding_token
+from .utils.gate import board_scans
+from .utils.inventory import rebuild_inventory, reserve_seat
+from .utils.mail_queue import flush_outbox
+from .utils.user_groups import update_group_members
+from .utils.ticket_documents import get_storage, prune_documents
+from .utils.wayforpay import SECRET_KEY, create_request_params, generate_hmac
+from .views import IndexView, book_ticket, desk_tickets, save_check_in, save_customization
+
+
+def create_flight(airplane=None):
+    """A flight from Kyiv to Lviv tomorrow, on a new airplane of the smallest size unless one is given."""
+    airplane = airplane or Airplane.objects.create(economy_seats=20, business_seats=6)
+    departure = timezone.now() + timedelta(days=1)
+    return Flight.objects.create(
+        date_time_of_departure=departure,
+        date_time_of_arrival=departure + timedelta(hours=2),
+        place_of_departure='Kyiv',
+        place_of_arrival='Lviv',
+        airplane=airplane,
+        available_economy_seats=airplane.economy_seats,
+        available_business_seats=airplane.business_seats,
+    )
+
+
+class IndexViewQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='manager@djangoair.com', password='password')
+        self.user.user_permissions.add(Permission.objects.get(codename='add_flight'))
+        self.client.force_login(self.user)
+        self.airplane = Airplane.objects.create(economy_seats=20, business_seats=6)
+
+    def create_flights(self, count):
+        for _ in range(count):
+            flight = create_flight(self.airplane)
+            Ticket.objects.bulk_create([
+                Ticket(flight=flight, seat_class='economy', status='checked_out', check_in_manager=self.user),
+                Ticket(flight=flight, seat_class='economy', status='checked_out', gate_manager=self.user),
+                Ticket(flight=flight, seat_class='business', status='booked'),
+            ])
+            rebuild_inventory(flight)
+
+    def count_home_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('customer_interface:home'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_counters(self):
+        self.create_flights(1)
+        _, response = self.count_home_queries()
+        flight = response.context['object_list'][0]
+        self.assertEqual(flight.sold_tickets, 2)
+        self.assertEqual(flight.check_in_tickets, 1)
+        self.assertEqual(flight.gate_tickets, 1)
+
+    def test_query_count_does_not_grow_with_flights(self):
+        self.create_flights(1)
+        single_flight_queries, _ = self.count_home_queries()
+        self.create_flights(30)
+        many_flights_queries, response = self.count_home_queries()
+        self.assertEqual(single_flight_queries, many_flights_queries)
+        self.assertEqual(len(response.context['object_list']), IndexView.paginate_by)
+
+
+class TicketDocumentPruneTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(TICKET_DOCUMENTS_ROOT=directory.name, TICKET_DOCUMENTS_MAX_AGE=60)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = get_storage()
+
+    def store(self, name, age):
+        self.storage.save(name, ContentFile(b'%PDF'))
+        modified = time.time() - age
+        os.utime(self.storage.path(name), (modified, modified))
+
+    def test_prunes_unused_documents_of_tickets_and_orders(self):
+        self.store('tickets/1/old.pdf', age=120)
+        self.store('tickets/1/new.pdf', age=0)
+        self.store('orders/old.pdf', age=120)
+        self.assertEqual(prune_documents(self.storage), 2)
+        self.assertFalse(self.storage.exists('tickets/1/old.pdf'))
+        self.assertFalse(self.storage.exists('orders/old.pdf'))
+        self.assertTrue(self.storage.exists('tickets/1/new.pdf'))
+
+    def test_keeps_documents_of_pending_emails(self):
+        self.store('tickets/1/queued.pdf', age=120)
+        self.store('orders/sent.pdf', age=120)
+        OutboundEmail.objects.create(
+            subject='Ticket', body='', to=['a@b.c'], attachment_document='tickets/1/queued.pdf',
+        )
+        OutboundEmail.objects.create(subject='Ticket', body='', to=['a@b.c'], attachment_document='orders/sent.pdf',
+                                     status='sent')
+        self.assertEqual(prune_documents(self.storage), 1)
+        self.assertTrue(self.storage.exists('tickets/1/queued.pdf'))
+        self.assertFalse(self.storage.exists('orders/sent.pdf'))
+
+    @override_settings(EMAIL_RATE_PER_SECOND=1000, EMAIL_BURST=1000)
+    def test_missing_attachment_fails_without_retries(self):
+        outbound = OutboundEmail.objects.create(subject='Ticket', body='', to=['a@b.c'], attachment_name='ticket.pdf',
+                                                attachment_document='tickets/1/pruned.pdf')
+        with self.assertLogs('customer_interface.utils.mail_queue', 'ERROR'):
+            self.assertEqual(flush_outbox(), 0)
+        outbound.refresh_from_db()
+        self.assertEqual((outbound.status, outbound.attempts), ('failed', 1))
+        self.assertEqual(mail.outbox, [])
+
+
+class ManifestCsvTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='manager@djangoair.com', password='password')
+        self.user.user_permissions.add(Permission.objects.get(codename='view_flight'))
+        self.client.force_login(self.user)
+        self.flight = create_flight()
+        Ticket.objects.bulk_create([
+            Ticket(flight=self.flight, seat_class='economy', status='checked_out', last_name=f'Passenger {number}')
+            for number in range(5)
+        ])
+
+    async def test_streams_the_rows_in_chunks(self):
+        self.async_client.cookies = self.client.cookies
+        with mock.patch('customer_interface.utils.manifest.CSV_CHUNK_ROWS', 2):
+            response = await self.async_client.get(
+                reverse('customer_interface:flight_manifest_csv', args=[self.flight.pk]),
+            )
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response]
+        self.assertEqual(len(chunks), 3)  # The header and 5 rows, 2 lines per chunk
+        lines = b''.join(chunks).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith('Flight,From,To'))
+
+
+class InvoiceRequestTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='buyer@djangoair.com', password='password')
+        self.client.force_login(self.user)
+        self.order = Order.objects.create(user=self.user)
+
+    def buy(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('customer_interface:buy_order', args=[self.order.id]))
+        self.order.refresh_from_db()
+
+    def test_invoice_is_queued_after_the_order_is_pending(self):
+        with mock.patch('customer_interface.views.create_invoice.delay') as delay:
+            self.buy()
+        delay.assert_called_once_with(self.order.id)
+        self.assertEqual(self.order.payment_status, 'pending')
+        self.assertIsNotNone(self.order.payment_requested_at)
+
+    def test_order_can_be_bought_again_when_the_task_cannot_be_queued(self):
+        with mock.patch('customer_interface.views.create_invoice.delay', side_effect=OSError('broker is down')):
+            self.buy()
+        self.assertEqual(self.order.payment_status, 'failed')
+
+    def test_order_with_an_outstanding_invoice_is_not_changed(self):
+        Order.objects.filter(id=self.order.id).update(payment_status='invoiced', invoice_url='https://pay/1')
+        response = self.client.post(reverse('customer_interface:ticket_customization', args=[self.order.id]))
+        self.assertRedirects(
+            response, reverse('customer_interface:ticket_customization', args=[self.order.id]),
+            fetch_redirect_response=False,
+        )
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.payment_status, self.order.invoice_url), ('invoiced', 'https://pay/1'))
+
+    @override_settings(WAYFORPAY_PENDING_TIMEOUT_SECONDS=600)
+    def test_stale_pending_orders_are_released(self):
+        fresh = Order.objects.create(user=self.user, payment_status='pending', payment_requested_at=timezone.now())
+        Order.objects.filter(id=self.order.id).update(
+            payment_status='pending', payment_requested_at=timezone.now() - timedelta(minutes=11),
+        )
+        self.assertEqual(release_stale_invoice_requests(), 1)
+        self.order.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((self.order.payment_status, fresh.payment_status), ('failed', 'pending'))
+
+
+class SettlePaidOrdersTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='buyer@djangoair.com', password='password')
+        self.flight = create_flight()
+        self.order = Order.objects.create(user=self.user, payment_status='invoiced')
+
+    def add_tickets(self, count, status, order=None):
+        Ticket.objects.bulk_create([
+            Ticket(flight=self.flight, order=order, seat_class='business', status=status) for _ in range(count)
+        ])
+        rebuild_inventory(self.flight)
+
+    def business_counters(self):
+        return SeatInventory.objects.filter(flight=self.flight, seat_class='business').values_list(
+            'held', 'sold').get()
+
+    def settle(self):
+        with self.captureOnCommitCallbacks():
+            settled = settle_paid_orders([self.order.id])
+        self.order.refresh_from_db()
+        return settled
+
+    def test_an_order_is_settled_once(self):
+        self.add_tickets(2, 'booked', self.order)
+        self.assertEqual(self.settle(), [self.order.id])
+        self.assertEqual(self.settle(), [])
+        self.assertEqual(self.order.payment_status, 'paid')
+        self.assertEqual(self.business_counters(), (0, 2))
+        self.assertEqual(set(self.order.tickets.values_list('status', flat=True)), {'checked_out'})
+
+    def test_payment_of_another_sum_is_not_settled(self):
+        Order.objects.filter(id=self.order.id).update(price=Decimal('326.50'))
+        self.add_tickets(2, 'booked', self.order)
+        with self.captureOnCommitCallbacks(), self.assertLogs('customer_interface.tasks', 'ERROR'):
+            self.assertEqual(settle_paid_orders([self.order.id], {self.order.id: 300}), [])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'refund')
+        self.assertEqual(self.business_counters(), (2, 0))
+
+        self.order.payment_status = 'invoiced'
+        self.order.save()
+        with self.captureOnCommitCallbacks():
+            self.assertEqual(settle_paid_orders([self.order.id], {self.order.id: 326.5}), [self.order.id])
+
+    def test_customization_keeps_statuses_changed_after_the_page_loaded(self):
+        self.add_tickets(2, 'booked', self.order)
+        Order.objects.filter(id=self.order.id).update(payment_status='new')
+        loaded_tickets = list(self.order.tickets.select_related('flight'))
+        with self.captureOnCommitCallbacks():
+            settle_paid_orders([self.order.id])
+        request = RequestFactory().post('/', {f'first_name_{ticket.id}': 'Taras' for ticket in loaded_tickets})
+        save_customization(request, self.order, loaded_tickets)
+        self.assertEqual(set(self.order.tickets.values_list('status', 'first_name')), {('checked_out', 'Taras')})
+
+    def test_late_payment_takes_the_seats_again_when_they_are_free(self):
+        self.add_tickets(2, 'available', self.order)
+        self.assertEqual(self.settle(), [self.order.id])
+        self.assertEqual(self.business_counters(), (0, 2))
+
+    def test_late_payment_does_not_oversell(self):
+        self.add_tickets(5, 'checked_out')
+        self.add_tickets(2, 'available', self.order)
+        with self.assertLogs('customer_interface.tasks', 'ERROR'):
+            self.assertEqual(self.settle(), [])
+        self.assertEqual(self.order.payment_status, 'refund')
+        self.assertEqual(self.business_counters(), (0, 5))
+        self.assertEqual(set(self.order.tickets.values_list('status', flat=True)), {'available'})
+        self.assertEqual(self.settle(), [])
+
+
+@mock.patch('customer_interface.tasks.HoldStore', mock.Mock())
+class TicketExpiryTest(TestCase):
+    def setUp(self):
+        self.flight = create_flight()
+        self.basket = Basket.objects.get(
+            user=get_user_model().objects.create_user(email='late@djangoair.com', password='password'),
+        )
+        self.ticket = Ticket.objects.create(flight=self.flight, seat_class='business')
+        Ticket.objects.filter(id=self.ticket.id).update(created_at=timezone.now() - timedelta(hours=1))
+        self.basket.tickets.add(self.ticket)
+        rebuild_inventory(self.flight)
+
+    def held(self):
+        return SeatInventory.objects.get(flight=self.flight, seat_class='business').held
+
+    def test_expired_ticket_stays_in_the_cart(self):
+        self.assertEqual(sweep_expired_tickets(), 1)
+        self.assertEqual(sweep_expired_tickets(), 0)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.status, 'available')
+        self.assertEqual(self.held(), 0)
+        self.assertQuerysetEqual(self.basket.tickets.all(), [self.ticket])
+        self.basket.refresh_from_db()
+        self.assertEqual(self.basket.messages.count('has expired'), 1)
+
+    def test_next_booking_takes_the_expired_ticket_out_of_the_cart(self):
+        sweep_expired_tickets()
+        other_basket = Basket.objects.get(
+            user=get_user_model().objects.create_user(email='next@djangoair.com', password='password'),
+        )
+        with self.captureOnCommitCallbacks():
+            book_ticket(Ticket(flight=self.flight, seat_class='business'), other_basket)
+        self.assertFalse(Ticket.objects.filter(id=self.ticket.id).exists())
+        self.basket.refresh_from_db()
+        self.assertIn('we have removed', self.basket.messages)
+        self.assertEqual(self.held(), 1)
+
+
+@mock.patch('customer_interface.views.send_tickets.apply_async', mock.Mock())
+class DeskCheckInTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='desk@djangoair.com', password='password')
+        self.user.user_permissions.add(Permission.objects.get(codename='view_ticket'))
+        self.client.force_login(self.user)
+        self.flight = create_flight()
+        self.lunch = FlightFacilities.objects.create(
+            flight=self.flight, facilities=Facilities.objects.create(facilities_name='lunch'), price=7,
+        )
+        self.orders = [Order.objects.create(user=self.user, payment_status='paid') for _ in range(2)]
+        self.tickets = Ticket.objects.bulk_create([
+            Ticket(flight=self.flight, order=order, seat_class='economy', status='checked_out', last_name='Shevchenko')
+            for order in self.orders for _ in range(2)
+        ])
+        rebuild_inventory(self.flight)
+
+    def test_every_order_is_charged_for_its_own_tickets(self):
+        first, second = self.orders
+        self.client.post(reverse('customer_interface:desk_check_in') + '?last_name=shevchenko', {
+            f'facilities_{self.tickets[0].id}': self.lunch.id,
+            f'facilities_{self.tickets[1].id}': self.lunch.id,
+            f'facilities_{self.tickets[2].id}': self.lunch.id,
+        })
+        charges = FacilitiesOrder.objects.order_by('order_id').values_list('order_id', 'ticket_id', 'price')
+        self.assertEqual(list(charges), [(first.id, None, 14), (second.id, None, 7)])
+
+    def test_stale_desk_page_does_not_count_the_check_in_twice(self):
+        stale_tickets = desk_tickets(last_name='Shevchenko')
+        self.client.post(reverse('customer_interface:desk_check_in') + '?last_name=shevchenko')
+        request = RequestFactory().post('/', {f'facilities_{self.tickets[0].id}': self.lunch.id})
+        request.user = self.user
+        self.assertEqual(save_check_in(request, stale_tickets), 7)
+        self.assertEqual(SeatInventory.objects.get(flight=self.flight, seat_class='economy').checked_in, 4)
+
+
+class InvoiceParamsTest(TestCase):
+    def quote(self, *prices):
+        items = [{'ticket_id': number, 'seat_class': 'economy', 'total': Decimal(price)}
+                 for number, price in enumerate(prices, 1)]
+        return {'items': items, 'total': sum(item['total'] for item in items)}
+
+    def test_amounts_are_sent_and_signed_in_the_same_form(self):
+        params = create_request_params(self.quote('100.00', '226.50'), 'buyer@djangoair.com', 1)
+        self.assertEqual(params['amount'], Decimal('326.5'))
+        self.assertEqual(params['productPrice'], [100, 226.5])
+        self.assertEqual([str(price) for price in params['productPrice']], ['100', '226.5'])
+        signed = [
+            params['merchantAccount'], params['merchantDomainName'], params['orderReference'],
+            str(params['orderDate']), '326.5', 'UAH', *params['productName'], '1', '1', '100', '226.5',
+        ]
+        self.assertEqual(params['merchantSignature'], generate_hmac(signed, SECRET_KEY))
+
+    def test_whole_sums_have_no_fraction(self):
+        params = create_request_params(self.quote('100.00'), 'buyer@djangoair.com', 1)
+        self.assertEqual(str(params['amount']), '100')
+
+
+class ReserveSeatTest(TransactionTestCase):
+    def setUp(self):
+        self.flight = create_flight()
+
+    def test_the_last_seat_is_sold_once(self):
+        Ticket.objects.bulk_create([
+            Ticket(flight=self.flight, seat_class='business', status='checked_out') for _ in range(5)
+        ])
+        reserve_seat(self.flight, 'business')
+        with self.assertRaisesMessage(ValidationError, 'This flight full'):
+            reserve_seat(self.flight, 'business')
+        inventory = SeatInventory.objects.get(flight=self.flight, seat_class='business')
+        self.assertEqual((inventory.held, inventory.sold), (1, 5))
+
+    def test_concurrent_bookings_take_the_free_seats_only(self):
+        Ticket.objects.bulk_create([
+            Ticket(flight=self.flight, seat_class='business', status='checked_out') for _ in range(4)
+        ])
+        rebuild_inventory(self.flight)
+        start = threading.Barrier(6)
+        results = []
+
+        def book():
+            try:
+                start.wait()
+                reserve_seat(self.flight, 'business')
+                results.append('reserved')
+            except ValidationError:
+                results.append('full')
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=book) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), ['full'] * 4 + ['reserved'] * 2)
+        self.assertEqual(SeatInventory.objects.get(flight=self.flight, seat_class='business').held, 2)
+
+
+class BoardingTokenTest(TestCase):
+    def setUp(self):
+        flight = create_flight()
+        self.ticket = Ticket.objects.create(flight=flight, seat_class='business', seat_number=3, status='checked_out')
+        self.token = make_boarding_token(self.ticket)
+
+    def test_token_is_read_back(self):
+        self.assertEqual(
+            read_boarding_token(self.token.lower()), (self.ticket.id, self.ticket.flight_id, 3, 'business'),
+        )
+
+    def test_tampered_tokens_are_rejected(self):
+        body = self.token[len(TOKEN_PREFIX):]
+        data = base64.b32decode(body + '=' * (-len(body) % 8))
+        # Another seat with the signature of the original pass
+        forged = PAYLOAD.pack(self.ticket.id, self.ticket.flight_id, 1, 1) + data[PAYLOAD.size:]
+        tampered = [
+            TOKEN_PREFIX + base64.b32encode(forged).decode().rstrip('='),
+            self.token[:5] + ('A' if self.token[5] != 'A' else 'B') + self.token[6:],
+            self.token[:-2],
+            'XX1' + body,
+            TOKEN_PREFIX + '0189',
+        ]
+        for token in tampered:
+            with self.subTest(token=token), self.assertRaisesMessage(ValidationError, 'Not a valid boarding pass'):
+                read_boarding_token(token)
+
+
+class BoardScansTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='gate@djangoair.com', password='password')
+        self.flight = create_flight()
+        self.checked_in, self.not_checked_in = Ticket.objects.bulk_create([
+            Ticket(flight=self.flight, seat_class='economy', status='checked_out', check_in_manager=self.user),
+            Ticket(flight=self.flight, seat_class='economy', status='checked_out'),
+        ])
+        rebuild_inventory(self.flight)
+
+    def boarded(self):
+        return SeatInventory.objects.get(flight=self.flight, seat_class='economy').boarded
+
+    def test_a_replayed_scan_boards_once(self):
+        token = make_boarding_token(self.checked_in)
+        scanned_at = timezone.now() - timedelta(minutes=5)
+        results = board_scans(self.flight.id, [
+            {'code': token, 'scanned_at': scanned_at},
+            {'code': token},
+            {'code': str(self.not_checked_in.id)},
+        ], self.user)
+        self.assertEqual([result['status'] for result in results], ['boarded', 'already_boarded', 'rejected'])
+        self.assertEqual(results[2]['error'], 'This ticket is not checked in')
+
+        # A device that lost the response sends the offline scan again
+        replay = board_scans(self.flight.id, [{'code': token, 'scanned_at': timezone.now()}], self.user)
+        self.assertEqual(replay[0]['status'], 'already_boarded')
+        self.checked_in.refresh_from_db()
+        self.assertEqual(self.checked_in.time_gate, scanned_at)
+        self.assertEqual(self.boarded(), 1)
+
+    def test_scans_of_other_flights_are_rejected(self):
+        other = Ticket.objects.create(
+            flight=create_flight(self.flight.airplane), seat_class='economy', status='checked_out',
+            check_in_manager=self.user,
+        )
+        scans = [{'code': make_boarding_token(other)}, {'code': str(other.id)}]
+        results = board_scans(self.flight.id, scans, self.user)
+        self.assertEqual([result['status'] for result in results], ['rejected', 'rejected'])
+        self.assertEqual(self.boarded(), 0)
+
+
+class UpdateGroupMembersTest(TestCase):
+    def setUp(self):
+        self.gate, self.desk = Group.objects.create(name='Gate'), Group.objects.create(name='Desk')
+        self.users = [
+            get_user_model().objects.create_user(email=f'manager{number}@djangoair.com', password='password')
+            for number in range(3)
+        ]
+        self.first, self.second, self.hidden = self.users
+        self.first.groups.add(self.gate)
+        self.hidden.groups.add(self.gate)
+
+    def test_only_the_changed_memberships_are_written(self):
+        shown = {self.first.id, self.second.id}
+        added, removed = update_group_members(shown, {self.gate: {self.second.id}, self.desk: {self.first.id}})
+        self.assertEqual(added, {(self.second.id, self.gate.id), (self.first.id, self.desk.id)})
+        self.assertEqual(removed, {(self.first.id, self.gate.id)})
+        self.assertEqual(list(self.first.groups.all()), [self.desk])
+        self.assertEqual(list(self.second.groups.all()), [self.gate])
+        # Users that were not on the page keep their groups
+        self.assertEqual(list(self.hidden.groups.all()), [self.gate])
+
+        with self.assertNumQueries(3):  # Nothing changed: the savepoint and the read of the memberships only
+            self.assertEqual(
+                update_group_members(shown, {self.gate: {self.second.id}, self.desk: {self.first.id}}),
+                (set(), set()),
+            )
+
+
+class AvailabilityCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_a_cached_read_is_one_cache_round_trip(self):
+        cached_availability(1, 'seats', lambda: 'first')
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many, \
+                mock.patch.object(cache, 'set', side_effect=AssertionError), \
+                mock.patch.object(cache, 'get_or_set', side_effect=AssertionError):
+            self.assertEqual(cached_availability(1, 'seats', lambda: 'second'), 'first')
+        get_many.assert_called_once()
+
+    def test_a_bump_or_a_value_of_an_older_version_is_read_again(self):
+        cached_availability(1, 'seats', lambda: 'first')
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_availability(1)
+        self.assertEqual(cached_availability(1, 'seats', lambda: 'second'), 'second')
+        # A reader that loaded before the bump writes its value under the old version
+        cache.set('flight:1:availability:seats', (0, 'stale'))
+        self.assertEqual(cached_availability(1, 'seats', lambda: 'third'), 'third')
@@ -11,14 +11,21 @@ urlpatterns = [
     path('delete_ticket/<int:ticket_id>/', views.delete_ticket, name='delete_ticket'),
     path('ticket_customization/<int:order_id>/', views.ticket_customization, name='ticket_customization'),
     path('buy_order/<int:order_id>/', views.buy_order, name='buy_order'),
+    path('ticket/<int:ticket_id>/pdf/', views.ticket_pdf, name='ticket_pdf'),
     path('home/', views.IndexView.as_view(), name='home'),
     path('flight/<int:pk>/', views.FlightDetailView.as_view(), name='flight_detail'),
+    path('flight/airports/', views.airport_autocomplete, name='airport_autocomplete'),
     path('ticket_input/', views.ticket_input, name='ticket_input'),
     path('ticket_detail/<int:ticket_id>/', views.ticket_detail, name='ticket_detail'),
+    path('desk_check_in/', views.desk_check_in, name='desk_check_in'),
     path('ticket_gate/', views.ticket_gate, name='ticket_gate'),
     path('create_flight/', views.CreateFlightView.as_view(), name='create_flight'),
     path('users_list/', views.UsersList.as_view(), name='users_list'),
     path('save_user_groups/', views.SaveUserGroupsView.as_view(), name='save_user_groups'),
     path('flight_stats/<int:pk>/', views.flight_stats, name='flight_stats'),
+    path('flight_stats/<int:pk>/manifest.csv', views.manifest_csv, name='flight_manifest_csv'),
+    path('manifest/<str:day>.csv', views.manifest_csv, name='day_manifest_csv'),
+    path('flight_events/', views.flight_events, name='flight_events'),
+    path('api/v1/gate/<int:flight_id>/board/', views.GateBoardingAPI.as_view(), name='gate_boarding'),
     path('api/v1/wayforpay_callback/', views.WayForPayCallback.as_view(), name='wayforpay_callback'),
 ]
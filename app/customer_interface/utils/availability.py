@@ -0,0 +1,39 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+AVAILABILITY_TIMEOUT = 60 * 60
+
+
+def _version_key(flight_id):
+    return f'flight:{flight_id}:availability:version'
+
+
+def cached_availability(flight_id, name, load):
+    """Value `name` of the flight computed by load(), cached for the current availability version.
+
+    The value is stored with the version it was computed for, so the version and the value are read with one
+    get_many and a value written by a reader that raced a bump is simply computed again.
+    """
+    version_key, value_key = _version_key(flight_id), f'flight:{flight_id}:availability:{name}'
+    cached = cache.get_many([version_key, value_key])
+    version = cached.get(version_key)
+    if version is not None and value_key in cached and cached[value_key][0] == version:
+        return cached[value_key][1]
+    if version is None:
+        # A missing version starts from the clock, so it can never repeat a version that was evicted earlier.
+        version = cache.get_or_set(version_key, time.time_ns, timeout=None)
+    value = load()
+    cache.set(value_key, (version, value), timeout=AVAILABILITY_TIMEOUT)
+    return value
+
+
+def bump_availability(flight_id):
+    """Moves readers of the flight availability to a new version once the current transaction commits."""
+    def bump():
+        try:
+            cache.incr(_version_key(flight_id))
+        except ValueError:
+            cache.set(_version_key(flight_id), time.time_ns(), timeout=None)
+    transaction.on_commit(bump)
@@ -0,0 +1,78 @@
+import base64
+import hmac
+import struct
+
+from django.core.exceptions import ValidationError
+from django.utils.crypto import salted_hmac
+
+from customer_interface.models import Ticket
+from customer_interface.utils.availability import cached_availability
+
+TOKEN_PREFIX = 'DA1'
+SIGNATURE_SIZE = 10
+# ticket id, flight id, seat number (0 without a seat) and seat class
+PAYLOAD = struct.Struct('>IIHB')
+SEAT_CLASS_CODES = {'economy': 0, 'business': 1}
+
+
+def _signature(payload):
+    return salted_hmac('customer_interface.boarding', payload, algorithm='sha256').digest()[:SIGNATURE_SIZE]
+
+
+def make_boarding_token(ticket):
+    """Compact signed boarding pass: base32 of the packed ticket fields and a truncated HMAC-SHA256.
+
+    Base32 keeps the token in the QR alphanumeric mode, so the code stays small and quick to scan.
+    """
+    payload = PAYLOAD.pack(ticket.id, ticket.flight_id, ticket.seat_number or 0, SEAT_CLASS_CODES[ticket.seat_class])
+    token = base64.b32encode(payload + _signature(payload)).decode('ascii').rstrip('=')
+    return f'{TOKEN_PREFIX}{token}'
+
+
+def read_boarding_token(token):
+    """Checks the signature and returns (ticket_id, flight_id, seat_number, seat_class) of the boarding pass."""
+    token = (token or '').strip().upper()
+    if not token.startswith(TOKEN_PREFIX):
+        raise ValidationError('Not a valid boarding pass')
+    body = token[len(TOKEN_PREFIX):]
+    try:
+        data = base64.b32decode(body + '=' * (-len(body) % 8))
+    except ValueError:
+        raise ValidationError('Not a valid boarding pass')
+    payload, signature = data[:PAYLOAD.size], data[PAYLOAD.size:]
+    if len(signature) != SIGNATURE_SIZE or not hmac.compare_digest(signature, _signature(payload)):
+        raise ValidationError('Not a valid boarding pass')
+
+    ticket_id, flight_id, seat_number, seat_class_code = PAYLOAD.unpack(payload)
+    seat_class = 'business' if seat_class_code == SEAT_CLASS_CODES['business'] else 'economy'
+    return ticket_id, flight_id, seat_number or None, seat_class
+
+
+class FlightManifest:
+    """Paid tickets of one flight, loaded once so every scan at the gate is verified in memory."""
+
+    def __init__(self, flight_id, tickets):
+        self.flight_id = flight_id
+        self.tickets = tickets
+
+    @classmethod
+    def load(cls, flight_id):
+        # Seat and status changes bump the availability version, so a cached manifest is never stale
+        tickets = cached_availability(flight_id, 'manifest', lambda: {
+            ticket_id: (seat_class, seat_number)
+            for ticket_id, seat_class, seat_number in Ticket.objects.filter(
+                flight_id=flight_id, status='checked_out',
+            ).values_list('id', 'seat_class', 'seat_number')
+        })
+        return cls(flight_id, tickets)
+
+    def verify(self, token):
+        """Returns the ticket id of a boarding pass that is valid for this flight, or raises ValidationError."""
+        ticket_id, flight_id, seat_number, seat_class = read_boarding_token(token)
+        if flight_id != self.flight_id:
+            raise ValidationError('This boarding pass is for another flight')
+        if ticket_id not in self.tickets:
+            raise ValidationError('This ticket is not paid')
+        if self.tickets[ticket_id] != (seat_class, seat_number):
+            raise ValidationError('This boarding pass is outdated, the seat has changed')
+        return ticket_id
@@ -0,0 +1,26 @@
+from django.core.exceptions import ValidationError
+
+from customer_interface.models import FlightFacilities, TicketFacilities
+
+
+def selected_facilities(tickets, facility_ids):
+    """Builds the TicketFacilities links for the facilities chosen per ticket id, with one query for all tickets.
+
+    Facilities the ticket already has are skipped, the caller saves the links with bulk_create.
+    """
+    try:
+        facility_ids = {ticket_id: {int(pk) for pk in ids} for ticket_id, ids in facility_ids.items()}
+    except ValueError:
+        raise ValidationError('Not a valid facility')
+    facilities = FlightFacilities.objects.in_bulk(set().union(*facility_ids.values()))
+
+    links = []
+    for ticket in tickets:
+        linked = {link.flight_facilities_id for link in ticket.ticketfacilities_set.all()}
+        for facility_id in sorted(facility_ids.get(ticket.id, set()) - linked):
+            facility = facilities.get(facility_id)
+            if facility is None or facility.flight_id != ticket.flight_id:
+                raise ValidationError('Not a valid facility')
+            links.append(TicketFacilities(ticket=ticket, flight_facilities=facility))
+    return links
+
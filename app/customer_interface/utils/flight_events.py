@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis.asyncio import Redis
+
+EVENTS_CHANNEL = 'customer_interface:flight:{flight_id}:events'
+EVENTS_PATTERN = EVENTS_CHANNEL.format(flight_id='*')
+# Counters the live dashboard shows, the holds of unpaid bookings change too often to be worth pushing
+LIVE_COUNTERS = ('sold', 'checked_in', 'boarded')
+
+
+def publish_counters(flight_id, seat_class, deltas):
+    """Publishes the counter deltas of the flight class to the live dashboards once the transaction commits."""
+    deltas = {counter: delta for counter, delta in deltas.items() if counter in LIVE_COUNTERS and delta}
+    if not deltas:
+        return
+    message = json.dumps({'flight': flight_id, 'seat_class': seat_class, 'deltas': deltas})
+    channel = EVENTS_CHANNEL.format(flight_id=flight_id)
+    # A dashboard that misses an event must not fail the sale or the check-in that caused it
+    transaction.on_commit(lambda: get_redis_connection('default').publish(channel, message), robust=True)
+
+
+class FlightEventHub:
+    """One Redis subscription per worker process, fanned out in memory to every open event stream."""
+
+    def __init__(self):
+        self.listeners = {}
+        self.task = None
+        self.ready = None
+
+    async def listen(self, flight_ids):
+        """Returns a queue that receives the events of the flights, the subscription is active when it returns."""
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.ready = asyncio.Event()
+            self.task = loop.create_task(self.run(self.ready))
+        queue = asyncio.Queue(maxsize=settings.LIVE_EVENTS_QUEUE_SIZE)
+        for flight_id in flight_ids:
+            self.listeners.setdefault(flight_id, set()).add(queue)
+        await self.ready.wait()
+        return queue
+
+    def forget(self, flight_ids, queue):
+        for flight_id in flight_ids:
+            queues = self.listeners.get(flight_id, set())
+            queues.discard(queue)
+            if not queues:
+                self.listeners.pop(flight_id, None)
+
+    async def run(self, ready):
+        client = Redis.from_url(settings.LIVE_EVENTS_REDIS_URL)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.psubscribe(EVENTS_PATTERN)
+            ready.set()
+            async for message in pubsub.listen():
+                if message['type'] != 'pmessage':
+                    continue
+                event = json.loads(message['data'])
+                for queue in list(self.listeners.get(event['flight'], ())):
+                    if not queue.full():
+                        queue.put_nowait(event)  # A stalled browser loses events instead of holding the others
+        finally:
+            # The streams end and the browsers reconnect, the next stream starts a new subscription
+            for queue in {queue for queues in self.listeners.values() for queue in queues}:
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+            self.listeners.clear()
+            ready.set()
+            await pubsub.aclose()
+            await client.aclose()
+
+
+hub = FlightEventHub()
+
+
+def sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def flight_event_stream(flight_ids, load_snapshot):
+    """Server-sent events of the flights: the current counters first, then a delta for every counter change."""
+    queue = await hub.listen(flight_ids)
+    loop = asyncio.get_running_loop()
+    # Django does not notice a browser that went away, so every stream ends in time and the browser reconnects
+    closes_at = loop.time() + settings.LIVE_EVENTS_STREAM_SECONDS
+    try:
+        # Subscribed before the snapshot is read, so no change between the two is lost
+        yield 'retry: 1000\n' + sse('snapshot', await load_snapshot())
+        while loop.time() < closes_at:
+            try:
+                event = await asyncio.wait_for(queue.get(), settings.LIVE_EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event is None:
+                return
+            yield sse('delta', event)
+    finally:
+        hub.forget(flight_ids, queue)
@@ -0,0 +1,70 @@
+import re
+from bisect import bisect_left
+from datetime import datetime, time, timedelta
+
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.core.cache import cache
+from django.utils import timezone
+
+from customer_interface.models import Flight
+
+AIRPORTS_CACHE_KEY = 'flight_search:airports'
+
+
+def _prefix_query(term):
+    """Every word of the term has to start a word of the place, e.g. "kyi" finds "Kyiv"."""
+    words = re.findall(r'\w+', term or '')
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config='simple')
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def search_flights(queryset, place_of_departure=None, place_of_arrival=None, date_from=None, date_to=None):
+    """Filters flights through the full text indexes of the places and the departure time index."""
+    departure_query = _prefix_query(place_of_departure)
+    if departure_query is not None:
+        # The expression matches the one of flight_departure_search_idx, so Postgres searches the GIN index
+        queryset = queryset.annotate(
+            departure_search=SearchVector('place_of_departure', config='simple'),
+        ).filter(departure_search=departure_query)
+
+    arrival_query = _prefix_query(place_of_arrival)
+    if arrival_query is not None:
+        queryset = queryset.annotate(
+            arrival_search=SearchVector('place_of_arrival', config='simple'),
+        ).filter(arrival_search=arrival_query)
+
+    if date_from:
+        queryset = queryset.filter(date_time_of_departure__gte=_day_start(date_from))
+    if date_to:
+        queryset = queryset.filter(date_time_of_departure__lt=_day_start(date_to) + timedelta(days=1))
+
+    return queryset.order_by('date_time_of_departure', 'pk')
+
+
+def airports():
+    """Sorted (lowercase name, name) pairs of every place of departure and arrival, cached until a flight changes."""
+    def load():
+        places = set(Flight.objects.values_list('place_of_departure', flat=True).distinct())
+        places.update(Flight.objects.values_list('place_of_arrival', flat=True).distinct())
+        return sorted((place.lower(), place) for place in places)
+    return cache.get_or_set(AIRPORTS_CACHE_KEY, load, timeout=None)
+
+
+def autocomplete_airports(prefix, limit=10):
+    places = airports()
+    prefix = prefix.lower()
+    matches = []
+    for key, place in places[bisect_left(places, (prefix,)):]:
+        if not key.startswith(prefix) or len(matches) == limit:
+            break
+        matches.append(place)
+    return matches
+
+
+def reset_airports_cache():
+    cache.delete(AIRPORTS_CACHE_KEY)
@@ -0,0 +1,70 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from customer_interface.models import Ticket
+from customer_interface.utils.boarding import FlightManifest, TOKEN_PREFIX
+from customer_interface.utils.inventory import shift_counters
+
+
+def _scanned_ticket(manifest, code):
+    code = str(code).strip()
+    if code.upper().startswith(TOKEN_PREFIX):
+        return manifest.verify(code)
+    if code.isdigit() and int(code) in manifest.tickets:
+        return int(code)  # Typed in by the gate manager
+    raise ValidationError('This ticket is not paid or is for another flight')
+
+
+def board_scans(flight_id, scans, user):
+    """Boards a batch of scans of one flight and returns one result per scan, in the order of the scans.
+
+    Every scan is a dict with the scanned `code` (boarding pass or ticket id) and, for scans a device replays after
+    working offline, the `scanned_at` time. The codes are checked against the flight manifest in memory, the boarded
+    tickets are written with one UPDATE and a scan of an already boarded ticket is reported, not repeated.
+    """
+    manifest = FlightManifest.load(flight_id)
+    results = []
+    scanned = {}
+    for scan in scans:
+        result = {'code': scan['code'], 'ticket_id': None, 'status': 'rejected', 'error': ''}
+        try:
+            result['ticket_id'] = _scanned_ticket(manifest, scan['code'])
+        except ValidationError as e:
+            result['error'] = e.message
+        else:
+            scanned.setdefault(result['ticket_id'], scan.get('scanned_at') or timezone.now())
+        results.append(result)
+
+    with transaction.atomic():
+        tickets = Ticket.objects.select_for_update().filter(id__in=scanned).values_list(
+            'id', 'seat_class', 'check_in_manager_id', 'gate_manager_id')
+        states = {ticket_id: (seat_class, check_in, gate) for ticket_id, seat_class, check_in, gate in tickets}
+        to_board = [ticket_id for ticket_id, (_, check_in, gate) in states.items() if check_in and not gate]
+        if to_board:
+            Ticket.objects.filter(id__in=to_board).update(
+                gate_manager=user,
+                time_gate=Case(*[When(id=ticket_id, then=Value(scanned[ticket_id])) for ticket_id in to_board],
+                               output_field=DateTimeField()),
+            )
+            for seat_class in {states[ticket_id][0] for ticket_id in to_board}:
+                shift_counters(flight_id, seat_class,
+                               boarded=sum(states[ticket_id][0] == seat_class for ticket_id in to_board))
+
+    boarded = set()
+    for result in results:
+        ticket_id = result['ticket_id']
+        if ticket_id is None:
+            continue
+        if ticket_id not in states:
+            result['error'] = 'This ticket is not paid'
+        elif states[ticket_id][1] is None:
+            result['error'] = 'This ticket is not checked in'
+        elif ticket_id in to_board and ticket_id not in boarded:
+            boarded.add(ticket_id)
+            result['status'] = 'boarded'
+        else:
+            # Scanned twice, or replayed by a device that lost the response
+            result['status'] = 'already_boarded'
+    return results
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+HOLDS_KEY = 'customer_interface:ticket_holds'
+
+
+class HoldStore:
+    """Seat holds of booked tickets, kept in a Redis sorted set scored by the expiry timestamp."""
+
+    def __init__(self, connection=None):
+        self.connection = connection or get_redis_connection('default')
+
+    def hold(self, *ticket_ids, seconds=None):
+        expires_at = time.time() + (seconds or settings.TICKET_HOLD_SECONDS)
+        if ticket_ids:
+            self.connection.zadd(HOLDS_KEY, {ticket_id: expires_at for ticket_id in ticket_ids})
+
+    def release(self, *ticket_ids):
+        if ticket_ids:
+            self.connection.zrem(HOLDS_KEY, *ticket_ids)
+
+    def expires_at(self, ticket_id):
+        return self.connection.zscore(HOLDS_KEY, ticket_id)
+
+    def pop_expired(self, limit=500):
+        """Takes up to `limit` expired holds out of the store and returns their ticket ids."""
+        ticket_ids = self.connection.zrangebyscore(HOLDS_KEY, '-inf', time.time(), start=0, num=limit)
+        if not ticket_ids:
+            return []
+
+        # ZREM reports which members this call removed, so two sweepers never expire the same ticket twice.
+        pipeline = self.connection.pipeline()
+        for ticket_id in ticket_ids:
+            pipeline.zrem(HOLDS_KEY, ticket_id)
+        removed = pipeline.execute()
+        return [int(ticket_id) for ticket_id, was_removed in zip(ticket_ids, removed) if was_removed]
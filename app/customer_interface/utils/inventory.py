@@ -0,0 +1,179 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+
+from customer_interface.models import SeatInventory, Ticket
+from customer_interface.utils.availability import bump_availability
+from customer_interface.utils.flight_events import publish_counters
+from customer_interface.utils.seat_map import SeatMap
+
+SEAT_CLASSES = ('economy', 'business')
+
+
+def _initial_counters(flight, seat_class):
+    tickets = Ticket.objects.filter(flight=flight, seat_class=seat_class)
+    counters = tickets.aggregate(
+        held=Count('id', filter=Q(status='booked')),
+        sold=Count('id', filter=Q(status='checked_out')),
+        checked_in=Count('id', filter=Q(status='checked_out', check_in_manager__isnull=False)),
+        boarded=Count('id', filter=Q(status='checked_out', gate_manager__isnull=False)),
+    )
+    seats = SeatMap(flight.seat_capacity(seat_class))
+    for seat_number in tickets.exclude(seat_number=None).values_list('seat_number', flat=True):
+        seats.occupy(seat_number)
+    return {'capacity': seats.capacity, 'seat_map': seats.to_bytes(), **counters}
+
+
+def flight_inventory(flight):
+    """Counters of every seat class of the flight, created from the ticket table the first time they are needed."""
+    rows = {row.seat_class: row for row in SeatInventory.objects.filter(flight=flight)}
+    for seat_class in SEAT_CLASSES:
+        if seat_class not in rows:
+            rows[seat_class], _ = SeatInventory.objects.get_or_create(
+                flight=flight,
+                seat_class=seat_class,
+                defaults=_initial_counters(flight, seat_class),
+            )
+    return rows
+
+
+def remaining_seats(flight):
+    return {seat_class: row.remaining for seat_class, row in flight_inventory(flight).items()}
+
+
+def seat_maps(flight):
+    return {seat_class: SeatMap(row.capacity, row.seat_map) for seat_class, row in flight_inventory(flight).items()}
+
+
+def reserve_seat(flight, seat_class):
+    """Holds one seat with a single conditional UPDATE, so two concurrent bookings can never take the last seat."""
+    reserved = SeatInventory.objects.filter(
+        flight=flight,
+        seat_class=seat_class,
+        capacity__gt=F('held') + F('sold'),
+    ).update(held=F('held') + 1)
+
+    if not reserved:
+        if SeatInventory.objects.filter(flight=flight, seat_class=seat_class).exists():
+            raise ValidationError('This flight full')
+        flight_inventory(flight)
+        reserve_seat(flight, seat_class)
+    else:
+        bump_availability(flight.pk)
+
+
+def shift_counters(flight_id, seat_class, **deltas):
+    """Adds the deltas to the named counters (held, sold, checked_in, boarded) of the flight class."""
+    updates = {counter: Greatest(F(counter) + delta, 0) for counter, delta in deltas.items() if delta}
+    if updates:
+        SeatInventory.objects.filter(flight_id=flight_id, seat_class=seat_class).update(**updates)
+        publish_counters(flight_id, seat_class, deltas)
+    if updates.keys() & {'held', 'sold'}:
+        bump_availability(flight_id)
+
+
+def shift_for_tickets(tickets, **deltas):
+    """Applies a per-ticket shift to the counters once per flight and seat class of the tickets queryset."""
+    groups = tickets.order_by().values('flight_id', 'seat_class').annotate(total=Count('id'))
+    for group in groups:
+        shift_counters(group['flight_id'], group['seat_class'],
+                       **{counter: delta * group['total'] for counter, delta in deltas.items()})
+
+
+def rebuild_inventory(flight):
+    """Recounts the counters and the seat maps of the flight from the ticket table."""
+    with transaction.atomic():
+        rows = {row.seat_class: row for row in SeatInventory.objects.select_for_update().filter(flight=flight)}
+        for seat_class in SEAT_CLASSES:
+            counters = _initial_counters(flight, seat_class)
+            if seat_class in rows:
+                SeatInventory.objects.filter(pk=rows[seat_class].pk).update(**counters)
+            else:
+                SeatInventory.objects.create(flight=flight, seat_class=seat_class, **counters)
+        bump_availability(flight.pk)
+
+
+def _locked_inventory(keys):
+    """Locks the inventory rows of the (flight_id, seat_class) keys with one query."""
+    condition = Q()
+    for flight_id, seat_class in keys:
+        condition |= Q(flight_id=flight_id, seat_class=seat_class)
+    return {(row.flight_id, row.seat_class): row for row in SeatInventory.objects.select_for_update().filter(condition)}
+
+
+def _seat_number(seat_number):
+    if seat_number is None:
+        return None
+    try:
+        return int(seat_number)
+    except ValueError:
+        raise ValidationError('Not a valid seat number')
+
+
+@transaction.atomic
+def assign_seats(seat_requests):
+    """Moves every ticket of the (ticket, seat_number) pairs to its seat, None frees the seat of the ticket.
+
+    All requests are checked against one locked seat map per flight class, so tickets of one order can also swap
+    seats. The tickets themselves are not saved, the caller stores the new seat numbers in the same transaction.
+    """
+    changes = [(ticket, _seat_number(seat_number)) for ticket, seat_number in seat_requests]
+    changes = [(ticket, seat_number) for ticket, seat_number in changes if seat_number != ticket.seat_number]
+    if not changes:
+        return
+
+    keys = {(ticket.flight_id, ticket.seat_class) for ticket, _ in changes}
+    rows = _locked_inventory(keys)
+    if len(rows) < len(keys):
+        for ticket, _ in changes:
+            if (ticket.flight_id, ticket.seat_class) not in rows:
+                flight_inventory(ticket.flight)
+        rows = _locked_inventory(keys)
+    seats = {key: SeatMap(row.capacity, row.seat_map) for key, row in rows.items()}
+
+    for ticket, _ in changes:
+        if ticket.seat_number:
+            seats[ticket.flight_id, ticket.seat_class].release(int(ticket.seat_number))
+    for ticket, seat_number in changes:
+        seat_map = seats[ticket.flight_id, ticket.seat_class]
+        if seat_number is not None:
+            if not 1 <= seat_number <= seat_map.capacity:
+                raise ValidationError('Not a valid seat number')
+            if not seat_map.is_free(seat_number):
+                raise ValidationError('this seat is busy')
+            seat_map.occupy(seat_number)
+        ticket.seat_number = seat_number
+
+    for key, row in rows.items():
+        row.seat_map = seats[key].to_bytes()
+    SeatInventory.objects.bulk_update(rows.values(), ['seat_map'])
+    for flight_id in {flight_id for flight_id, _ in keys}:
+        bump_availability(flight_id)
+
+
+def assign_seat(ticket, seat_number):
+    assign_seats([(ticket, seat_number)])
+
+
+@transaction.atomic
+def release_seat(flight_id, seat_class, seat_number):
+    inventory = SeatInventory.objects.select_for_update().filter(flight_id=flight_id, seat_class=seat_class).first()
+    if inventory is None:
+        return
+    seats = SeatMap(inventory.capacity, inventory.seat_map)
+    seats.release(seat_number)
+    inventory.seat_map = seats.to_bytes()
+    inventory.save(update_fields=['seat_map'])
+    bump_availability(flight_id)
+
+
+def release_ticket(ticket):
+    if ticket.status == 'booked':
+        shift_counters(ticket.flight_id, ticket.seat_class, held=-1)
+    elif ticket.status == 'checked_out':
+        shift_counters(ticket.flight_id, ticket.seat_class, sold=-1,
+                       checked_in=-1 if ticket.check_in_manager_id else 0,
+                       boarded=-1 if ticket.gate_manager_id else 0)
+    if ticket.seat_number:
+        release_seat(ticket.flight_id, ticket.seat_class, ticket.seat_number)
@@ -0,0 +1,146 @@
+import logging
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from customer_interface.models import OutboundEmail
+from customer_interface.utils.ticket_documents import get_storage
+
+FLUSH_QUEUED_KEY = 'customer_interface:outbound_email_flush_queued'
+
+logger = logging.getLogger(__name__)
+
+_bucket = None
+
+
+class MissingAttachment(Exception):
+    """The document the message attaches is no longer in the document store, sending again cannot help."""
+
+
+class TokenBucket:
+    """Allows `rate` messages per second on average with bursts of up to `capacity` messages."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+
+def get_bucket():
+    # The mail queue has a single consumer, so one bucket per process keeps the whole site under the quota
+    global _bucket
+    if _bucket is None:
+        _bucket = TokenBucket(settings.EMAIL_RATE_PER_SECOND, settings.EMAIL_BURST)
+    return _bucket
+
+
+def queue_email(subject, body, to, content_subtype='plain', attachment_name='', attachment_document=''):
+    """Stores the message for the mail worker, the attachment is referenced by its name in the document store.
+
+    The pending row pins the document, prune_documents keeps it until the message is sent or has failed.
+    """
+    outbound = OutboundEmail.objects.create(
+        subject=subject,
+        body=body,
+        to=list(to),
+        content_subtype=content_subtype,
+        attachment_name=attachment_name,
+        attachment_document=attachment_document,
+    )
+    transaction.on_commit(request_flush)
+    return outbound
+
+
+def request_flush():
+    from customer_interface.tasks import flush_outbound_email
+
+    # One flush task waiting in the queue is enough, it sends everything that is due when it starts
+    if cache.add(FLUSH_QUEUED_KEY, 1, timeout=60):
+        flush_outbound_email.delay()
+
+
+def build_message(outbound, storage, connection):
+    message = EmailMessage(outbound.subject, outbound.body, to=outbound.to, connection=connection)
+    message.content_subtype = outbound.content_subtype
+    if outbound.attachment_document:
+        try:
+            with storage.open(outbound.attachment_document, 'rb') as document:
+                message.attach(outbound.attachment_name, document.read(), 'application/pdf')
+        except FileNotFoundError:
+            raise MissingAttachment(outbound.attachment_document)
+    return message
+
+
+def is_transient(error):
+    if isinstance(error, MissingAttachment):
+        return False
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPException, OSError))
+
+
+def deliver(outbound, connection, storage):
+    outbound.attempts += 1
+    try:
+        message = build_message(outbound, storage, connection)
+        get_bucket().take()
+        # An explicitly opened connection stays open across send_messages calls
+        connection.open()
+        connection.send_messages([message])
+    except Exception as error:
+        if not isinstance(error, MissingAttachment):
+            connection.close()  # The next message opens a fresh connection
+        outbound.last_error = repr(error)
+        if is_transient(error) and outbound.attempts < settings.EMAIL_MAX_ATTEMPTS:
+            outbound.next_attempt_at = timezone.now() + timedelta(seconds=30 * 2 ** (outbound.attempts - 1))
+        else:
+            outbound.status = 'failed'
+            logger.error('Outbound email %s to %s failed after %s attempts: %r',
+                         outbound.pk, outbound.to, outbound.attempts, error)
+        return False
+    outbound.status = 'sent'
+    outbound.sent_at = timezone.now()
+    return True
+
+
+def flush_outbox(batch_size=None):
+    """Sends every due message over one reused SMTP connection and returns how many were sent."""
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    storage = get_storage()
+    connection = get_connection()
+    sent = 0
+    try:
+        while True:
+            with transaction.atomic():
+                batch = list(OutboundEmail.objects.select_for_update(skip_locked=True).filter(
+                    status='pending',
+                    next_attempt_at__lte=timezone.now(),
+                ).order_by('id')[:batch_size])
+                if not batch:
+                    break
+                sent += sum(deliver(outbound, connection, storage) for outbound in batch)
+                OutboundEmail.objects.bulk_update(
+                    batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'],
+                )
+    finally:
+        connection.close()
+    return sent
@@ -0,0 +1,44 @@
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def quote_tickets(tickets):
+    """Itemized prices of the tickets queryset, computed with one aggregate query over tickets, flights and facilities.
+
+    Every item holds the seat class price, the fee for a chosen seat number and the sum of the ticket facilities,
+    the quote total is the sum of the item totals.
+    """
+    rows = tickets.order_by('id').annotate(
+        seat_price=Case(
+            When(seat_class='economy', then=F('flight__price_economy_seats')),
+            default=F('flight__price_business_seats'),
+        ),
+        seat_number_price=Case(
+            When(seat_number__isnull=True, then=Value(0)),
+            When(seat_class='economy', then=F('flight__price_number_economy_seats')),
+            default=F('flight__price_number_business_seats'),
+        ),
+        facilities_price=Coalesce(
+            Sum('flight_facilities__price'), Value(0), output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+    ).values('id', 'flight_id', 'seat_class', 'seat_price', 'seat_number_price', 'facilities_price')
+
+    items = []
+    for row in rows:
+        total = row['seat_price'] + row['seat_number_price'] + row['facilities_price']
+        items.append({
+            'ticket_id': row['id'],
+            'flight_id': row['flight_id'],
+            'seat_class': row['seat_class'],
+            'seat': row['seat_price'],
+            'seat_number': row['seat_number_price'],
+            'facilities': row['facilities_price'],
+            'total': total,
+        })
+    return {'items': items, 'total': sum((item['total'] for item in items), Decimal(0))}
+
+
+def quote_order(order):
+    return quote_tickets(order.tickets.all())
@@ -0,0 +1,40 @@
+class SeatMap:
+    """Occupancy bitmap of one seat class of a flight, bit N-1 is set while seat N is taken."""
+
+    def __init__(self, capacity, data=b''):
+        self.capacity = capacity
+        self.bits = int.from_bytes(bytes(data or b''), 'little')
+
+    def to_bytes(self):
+        return self.bits.to_bytes((self.capacity + 7) // 8, 'little')
+
+    def _free_mask(self):
+        return ~self.bits & ((1 << self.capacity) - 1)
+
+    def is_free(self, seat_number):
+        return 1 <= seat_number <= self.capacity and not self.bits >> (seat_number - 1) & 1
+
+    def occupy(self, seat_number):
+        self.bits |= 1 << (seat_number - 1)
+
+    def release(self, seat_number):
+        self.bits &= ~(1 << (seat_number - 1))
+
+    def free_seats(self):
+        free = self._free_mask()
+        seats = []
+        while free:
+            lowest = free & -free
+            seats.append(lowest.bit_length())
+            free ^= lowest
+        return seats
+
+    def first_free_block(self, size):
+        """Number of the first seat of `size` free seats in a row, or None if there is no such block."""
+        free = self._free_mask()
+        block = free
+        for shift in range(1, size):
+            block &= free >> shift
+        if not block:
+            return None
+        return (block & -block).bit_length()
@@ -1,22 +1,33 @@
+from io import BytesIO
+
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-from django.conf import settings
-from django.core.mail import EmailMessage
 import segno
 
+from customer_interface.utils.boarding import make_boarding_token
+
 
-def create_ticket_pdf(ticket):
-    # Creating a PDF file
-    pdf_path = f'ticket_{ticket.id}.pdf'
-    c = canvas.Canvas(pdf_path, pagesize=letter)
+def draw_qr_code(c, data, x, y, size):
+    """Draws the QR code as vector squares, so rendering needs no image file."""
+    rows = [list(row) for row in segno.make(data).matrix_iter(border=4)]
+    module = size / len(rows)
+    for row_number, row in enumerate(rows):
+        bottom = y + size - (row_number + 1) * module
+        column = 0
+        while column < len(row):
+            if not row[column]:
+                column += 1
+                continue
+            # One rectangle per run of dark modules in the row
+            start = column
+            while column < len(row) and row[column]:
+                column += 1
+            c.rect(x + start * module, bottom, (column - start) * module, module, stroke=0, fill=1)
 
-    # Creating a QR code with ticket id
-    qr_code = segno.make(f'Ticket ID: {ticket.id}')
-    qr_code_path = 'qr_code.png'  # Path to save the QR code image
-    qr_code.save(qr_code_path)
 
-    # Inserting QR code into PDF
-    c.drawInlineImage(qr_code_path, x=400, y=675, width=100, height=100)
+def draw_ticket(c, ticket):
+    # QR code with the signed boarding pass
+    draw_qr_code(c, make_boarding_token(ticket), x=400, y=675, size=100)
 
     flight_info = f'Flight: {ticket.flight.place_of_departure} - {ticket.flight.place_of_arrival}'
     c.drawString(45, 750, flight_info)
@@ -46,17 +57,38 @@ def create_ticket_pdf(ticket):
             c.drawString(45, y_offset, facilities_info)
             y_offset -= 30
 
-    c.save()
-    return pdf_path
-
-
-def send_ticket_email(ticket, email):
-    pdf_path = create_ticket_pdf(ticket)
-    subject = 'Your flight ticket'
-    message = 'Thank you for using our airline company.'
-    email_from = settings.EMAIL_HOST_USER
-    recipient_list = [email]
 
-    email = EmailMessage(subject, message, email_from, recipient_list)
-    email.attach_file(pdf_path)
-    email.send()
+def create_tickets_pdf(tickets):
+    """Renders the tickets into PDF bytes, one page per ticket, without touching the disk."""
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    for ticket in tickets:
+        draw_ticket(c, ticket)
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def tickets_file_name(tickets):
+    if len(tickets) == 1:
+        return f'ticket_{tickets[0].id}.pdf'
+    if len({ticket.order_id for ticket in tickets}) == 1 and tickets[0].order_id:
+        return f'order_{tickets[0].order_id}.pdf'
+    return 'tickets.pdf'
+
+
+def send_tickets_email(tickets, email):
+    """Queues one message with all tickets in a single multi-page PDF, taken from the document store."""
+    from customer_interface.utils.mail_queue import queue_email
+    from customer_interface.utils.ticket_documents import ticket_document
+
+    tickets = list(tickets)
+    if not tickets:
+        return
+    queue_email(
+        subject='Your flight ticket' if len(tickets) == 1 else 'Your flight tickets',
+        body='Thank you for using our airline company.',
+        to=[email],
+        attachment_name=tickets_file_name(tickets),
+        attachment_document=ticket_document(tickets),
+    )
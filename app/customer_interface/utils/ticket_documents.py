@@ -0,0 +1,90 @@
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+
+from customer_interface.models import OutboundEmail
+from customer_interface.utils.send_tickets import create_tickets_pdf
+
+# Bump when the PDF layout changes, so documents rendered by the old layout are not reused
+LAYOUT_VERSION = 2
+
+
+def get_storage():
+    return FileSystemStorage(location=settings.TICKET_DOCUMENTS_ROOT)
+
+
+def ticket_fingerprint(ticket):
+    """Hash of every field the ticket PDF shows, it changes whenever the rendered document would change."""
+    flight = ticket.flight
+    fields = [
+        LAYOUT_VERSION,
+        ticket.id,
+        flight.place_of_departure,
+        flight.place_of_arrival,
+        flight.date_time_of_departure,
+        flight.date_time_of_arrival,
+        ticket.first_name,
+        ticket.last_name,
+        ticket.seat_class,
+        ticket.seat_number,
+        *[facility.facilities.facilities_name for facility in ticket.flight_facilities.all()],
+    ]
+    return hashlib.sha256('\x1f'.join(str(field) for field in fields).encode('utf-8')).hexdigest()
+
+
+def document_name(tickets):
+    fingerprints = [ticket_fingerprint(ticket) for ticket in tickets]
+    if len(tickets) == 1:
+        return f'tickets/{tickets[0].id}/{fingerprints[0]}.pdf'
+    return f'orders/{hashlib.sha256("".join(fingerprints).encode("utf-8")).hexdigest()}.pdf'
+
+
+def ticket_document(tickets, storage=None):
+    """Name of the stored PDF of the tickets, the PDF is rendered and saved only if no such document is stored yet.
+
+    The tickets should come with their flights and facilities loaded, the fingerprints read them. Older versions
+    stay in the store until prune_documents removes them, a queued email may still attach one of them.
+    """
+    storage = storage or get_storage()
+    name = document_name(tickets)
+    if storage.exists(name):
+        # A reused document counts as new, so the pruning never removes it before the caller has queued or served it
+        os.utime(storage.path(name))
+    else:
+        saved = storage.save(name, ContentFile(create_tickets_pdf(tickets)))
+        if saved != name:
+            storage.delete(saved)  # Another worker stored the same document first
+    return name
+
+
+def _stored_documents(storage):
+    if storage.exists('orders'):
+        yield from (f'orders/{name}' for name in storage.listdir('orders')[1])
+    if storage.exists('tickets'):
+        for folder in storage.listdir('tickets')[0]:
+            for name in storage.listdir(f'tickets/{folder}')[1]:
+                yield f'tickets/{folder}/{name}'
+
+
+def prune_documents(storage=None):
+    """Deletes the ticket and order documents that were not used for TICKET_DOCUMENTS_MAX_AGE seconds.
+
+    Documents attached to an email that is still waiting to be sent are kept, whatever their age. A pruned
+    document is rendered again if it is asked for, so the store only holds what was used recently.
+    """
+    storage = storage or get_storage()
+    cutoff = timezone.now() - timedelta(seconds=settings.TICKET_DOCUMENTS_MAX_AGE)
+    pinned = set(OutboundEmail.objects.filter(status='pending').exclude(attachment_document='').values_list(
+        'attachment_document', flat=True))
+    pruned = 0
+    for name in list(_stored_documents(storage)):
+        if name in pinned or storage.get_modified_time(name) > cutoff:
+            continue
+        storage.delete(name)
+        pruned += 1
+    return pruned
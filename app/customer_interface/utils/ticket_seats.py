@@ -1,11 +1,25 @@
-from customer_interface.models import Ticket
+from customer_interface.utils.availability import cached_availability
+from customer_interface.utils.inventory import flight_inventory, seat_maps
+from customer_interface.utils.seat_map import SeatMap
 
 
 def free_seats(flight, seat_class):
-    all_seat_numbers = set(range(1, flight.available_economy_seats + 1)) if seat_class == 'economy' \
-        else set(range(1, flight.available_business_seats + 1))
+    inventory = flight_inventory(flight)[seat_class]
+    return set(SeatMap(inventory.capacity, inventory.seat_map).free_seats())
 
-    busy_tickets = Ticket.objects.filter(flight=flight, seat_class=seat_class)
-    all_busy_seats = set(ticket.seat_number for ticket in busy_tickets)
 
-    return all_seat_numbers - all_busy_seats
+def flight_free_seats(flight):
+    """Free seats of both classes read from the flight seat maps with a single query."""
+    return {seat_class: set(seats.free_seats()) for seat_class, seats in seat_maps(flight).items()}
+
+
+def flight_availability(flight):
+    """Remaining seats and free seat numbers of both classes, cached under the current availability version."""
+    def load():
+        inventory = flight_inventory(flight)
+        return {
+            'remaining': {seat_class: row.remaining for seat_class, row in inventory.items()},
+            'free': {seat_class: set(SeatMap(row.capacity, row.seat_map).free_seats())
+                     for seat_class, row in inventory.items()},
+        }
+    return cached_availability(flight.pk, 'seats', load)
@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+
+
+@transaction.atomic
+def update_group_members(user_ids, members):
+    """Makes the users of user_ids members of exactly the groups that list them in `members`, {group: user ids}.
+
+    The change is computed against the current membership rows of those users only, and applied with one bulk
+    insert and one delete. Returns the added and the removed (user_id, group_id) pairs.
+    """
+    groups = get_user_model().groups
+    Membership = groups.through
+    # The through model names the user column after the user model
+    user_field = f'{groups.field.m2m_field_name()}_id'
+    user_ids = set(user_ids)
+    current = set(Membership.objects.filter(**{f'{user_field}__in': user_ids}, group__in=list(members)).values_list(
+        user_field, 'group_id'))
+    wanted = {(user_id, group.id) for group, group_members in members.items() for user_id in user_ids & group_members}
+
+    added, removed = wanted - current, current - wanted
+    # ignore_conflicts keeps a concurrent save of the same page from failing on the unique (user, group) pair
+    Membership.objects.bulk_create(
+        [Membership(**{user_field: user_id}, group_id=group_id) for user_id, group_id in sorted(added)],
+        ignore_conflicts=True,
+    )
+    if removed:
+        condition = Q()
+        for user_id, group_id in removed:
+            condition |= Q(**{user_field: user_id}, group_id=group_id)
+        Membership.objects.filter(condition).delete()
+    return added, removed
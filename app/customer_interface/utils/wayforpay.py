@@ -4,11 +4,27 @@ import time
 import requests
 import hashlib
 import hmac
+from decimal import Decimal
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 SECRET_KEY = 'flk3409refn54t54t*FNJRET'
 domain_name = '34.70.195.173'
 merchantAccount = 'test_merch_n1'
-WAYFORPAY_API = "https://api.wayforpay.com/api"
+
+_session = None
+
+
+class GatewayRetry(Retry):
+    """Repeats requests that never reached the gateway, and the ones it rejected with 429 or 503 and Retry-After."""
+    RETRY_AFTER_STATUS_CODES = frozenset({429, 503})
+    # Longest Retry-After the worker waits for, in seconds
+    RETRY_AFTER_MAX = 10
+
+    def parse_retry_after(self, retry_after):
+        return min(super().parse_retry_after(retry_after), self.RETRY_AFTER_MAX)
 
 
 # Функция для создания подписи HMAC_MD5
@@ -35,7 +51,17 @@ def decode_order_reference(order_id):
     return int(order_id, 16) - 10000111
 
 
-def create_request_params(price, email, ticket_count, order_id):
+def gateway_amount(value):
+    """A sum as the gateway expects it in the request and in the signature: "100" for whole sums, "326.5" otherwise.
+
+    The signature is built from str() of the sent value, which is also how the value appears in the JSON body.
+    """
+    amount = Decimal(value).quantize(Decimal('0.01'))
+    return int(amount) if amount == amount.to_integral_value() else float(amount)
+
+
+def create_request_params(quote, email, order_id):
+    """Invoice request for the order, every ticket of the pricing quote is sent as its own product."""
     orderReference = encode_order_reference(order_id)
     orderDate = int(time.time())
 
@@ -45,15 +71,15 @@ def create_request_params(price, email, ticket_count, order_id):
         "merchantDomainName": domain_name,
         "apiVersion": 1,
         "language": "en",
-        "serviceUrl": "http://34.70.195.173/api/v1/wayforpay_callback/",
+        "serviceUrl": settings.WAYFORPAY_SERVICE_URL,
         "orderReference": orderReference,
         "orderDate": orderDate,
-        "amount": price,
+        "amount": gateway_amount(quote['total']),
         "currency": "UAH",
         "orderTimeout": 86400,
-        "productName": ["Air Ticket"],
-        "productPrice": [21.1],
-        "productCount": [ticket_count],
+        "productName": [f"Air Ticket {item['seat_class']} #{item['ticket_id']}" for item in quote['items']],
+        "productPrice": [gateway_amount(item['total']) for item in quote['items']],
+        "productCount": [1 for _ in quote['items']],
         "paymentSystems": "card;privat24",
         "clientEmail": email,
         "order_id": order_id,
@@ -80,9 +106,43 @@ def create_request_params(price, email, ticket_count, order_id):
     return params
 
 
+def create_status_params(order_id):
+    """CHECK_STATUS request for the invoice of the order."""
+    params = {
+        "transactionType": "CHECK_STATUS",
+        "merchantAccount": merchantAccount,
+        "orderReference": encode_order_reference(order_id),
+        "apiVersion": 1,
+    }
+    params["merchantSignature"] = generate_hmac([params["merchantAccount"], params["orderReference"]], SECRET_KEY)
+    return params
+
+
+def get_session():
+    """One pooled session per process, so gateway calls reuse their keep-alive connections."""
+    global _session
+    if _session is None:
+        retry = GatewayRetry(
+            total=settings.WAYFORPAY_RETRIES,
+            connect=settings.WAYFORPAY_RETRIES,
+            # A CREATE_INVOICE that reached the gateway may have been processed, so it is never sent again
+            read=0,
+            other=0,
+            status=settings.WAYFORPAY_RETRIES,
+            backoff_factor=0.5,
+            allowed_methods=None,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _session = session
+    return _session
+
+
 # Функция для отправки запроса
 def send_request(params):
-    response = requests.post(WAYFORPAY_API, json=params)
+    response = get_session().post(settings.WAYFORPAY_API, json=params, timeout=settings.WAYFORPAY_TIMEOUT)
     return response
 
 
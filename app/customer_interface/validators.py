@@ -1,77 +1,34 @@
 from django.core.exceptions import ValidationError
 
 
-def create_ticket_validator(seat_class, seat_number, flight, Ticket):
-    if seat_class == 'economy':
-        total_tickets = Ticket.objects.filter(flight=flight, seat_class=seat_class,
-                                              status__in=['booked', 'checked_out']).count()
-        all_economy_seat = set(range(1, flight.available_economy_seats + 1))
-        if total_tickets >= flight.available_economy_seats:
-            raise ValidationError('This flight full')
-        if seat_number is not None:
-            try:
-                seat_number = int(seat_number)
-            except ValueError:
-                raise ValidationError('Not a valid seat number')
-
-            if seat_number not in all_economy_seat:
-                raise ValidationError('Not a valid seat number')
-        busy_tickets = Ticket.objects.filter(flight=flight, seat_class=seat_class)
-        all_busy_seats = set(ticket.seat_number for ticket in busy_tickets)
-        if seat_number is not None:
-            if seat_number in all_busy_seats:
-                raise ValidationError('this seat is busy')
+def seat_number_validator(seat_class, seat_number, flight, Ticket):
+    from customer_interface.utils.inventory import seat_maps
 
-    if seat_class == 'business':
-        total_tickets = Ticket.objects.filter(flight=flight, seat_class=seat_class,
-                                              status__in=['booked', 'checked_out']).count()
-        all_business_seat = set(range(1, flight.available_business_seats + 1))
-        if total_tickets >= flight.available_business_seats:
-            raise ValidationError('This flight full')
-        if seat_number is not None:
-            try:
-                seat_number = int(seat_number)
-            except ValueError:
-                raise ValidationError('Not a valid seat number')
+    if seat_number is None:
+        return
+    try:
+        seat_number = int(seat_number)
+    except ValueError:
+        raise ValidationError('Not a valid seat number')
 
-            if seat_number not in all_business_seat:
-                raise ValidationError('Not a valid seat number')
-        busy_tickets = Ticket.objects.filter(flight=flight, seat_class=seat_class)
-        all_busy_seats = set(ticket.seat_number for ticket in busy_tickets)
-        if seat_number is not None:
-            if seat_number in all_busy_seats:
-                raise ValidationError('this seat is busy')
+    if not 1 <= seat_number <= flight.seat_capacity(seat_class):
+        raise ValidationError('Not a valid seat number')
+    if not seat_maps(flight)[seat_class].is_free(seat_number):
+        raise ValidationError('this seat is busy')
 
 
-def update_ticket_validator(seat_class, seat_number, flight, Ticket):
-    if seat_class == 'economy':
-        all_economy_seat = set(range(1, flight.available_economy_seats + 1))
-        if seat_number is not None:
-            try:
-                seat_number = int(seat_number)
-            except ValueError:
-                raise ValidationError('Not a valid seat number')
+def create_ticket_validator(seat_class, seat_number, flight, Ticket):
+    from customer_interface.utils.inventory import remaining_seats
 
-            if seat_number not in all_economy_seat:
-                raise ValidationError('Not a valid seat number')
-        busy_tickets = Ticket.objects.filter(flight=flight, seat_class=seat_class)
-        all_busy_seats = set(ticket.seat_number for ticket in busy_tickets)
-        if seat_number is not None:
-            if seat_number in all_busy_seats:
-                raise ValidationError('this seat is busy')
+    if seat_class not in ('economy', 'business'):
+        return
+    # The counters only give a quick answer, the seat itself is taken by reserve_seat when the ticket is booked.
+    if remaining_seats(flight)[seat_class] <= 0:
+        raise ValidationError('This flight full')
+    seat_number_validator(seat_class, seat_number, flight, Ticket)
 
-    if seat_class == 'business':
-        all_business_seat = set(range(1, flight.available_business_seats + 1))
-        if seat_number is not None:
-            try:
-                seat_number = int(seat_number)
-            except ValueError:
-                raise ValidationError('Not a valid seat number')
 
-            if seat_number not in all_business_seat:
-                raise ValidationError('Not a valid seat number')
-        busy_tickets = Ticket.objects.filter(flight=flight, seat_class=seat_class)
-        all_busy_seats = set(ticket.seat_number for ticket in busy_tickets)
-        if seat_number is not None:
-            if seat_number in all_busy_seats:
-                raise ValidationError('this seat is busy')
+def update_ticket_validator(seat_class, seat_number, flight, Ticket):
+    if seat_class not in ('economy', 'business'):
+        return
+    seat_number_validator(seat_class, seat_number, flight, Ticket)
@@ -1,96 +1,124 @@
 import json
+import logging
 import time
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import wraps
 
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth import get_user_model
-from django.contrib.auth.decorators import permission_required
+from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.auth.models import Group
-from django.core.exceptions import ValidationError
+from django.core.exceptions import PermissionDenied, ValidationError
 from django.db import transaction
-from django.http import HttpResponseRedirect
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.http import FileResponse, Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy, reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.http import urlencode
 from django.views import generic, View
 
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.status import HTTP_400_BAD_REQUEST
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN
 
 from .decorators import process_exception
 from .forms import TicketForm, TicketSelectionForm, SearchFlightForm, CreateFlight, FlightFacilitiesFormSet, \
     SearchUserForm
-from .models import Ticket, Order, Basket, TicketFacilities, FlightFacilities, Flight, FacilitiesOrder
-from .tasks import send_tickets
-from .utils.ticket_seats import free_seats
-from .utils.wayforpay import create_request_params, send_request, handle_response, generate_response_signature, \
-    SECRET_KEY, decode_order_reference, generate_hmac
-from .validators import update_ticket_validator, create_ticket_validator
+from .models import Ticket, Order, Basket, TicketFacilities, FlightFacilities, Flight, FacilitiesOrder, SeatInventory
+from .serializers import GateBatchSerializer
+from .tasks import send_tickets, create_invoice, settle_paid_orders
+from .utils.boarding import read_boarding_token
+from .utils.customization import selected_facilities
+from .utils.flight_events import flight_event_stream
+from .utils.flight_search import search_flights, autocomplete_airports
+from .utils.gate import board_scans
+from .utils.holds import HoldStore
+from .utils.inventory import reserve_seat, assign_seat, assign_seats, shift_counters, shift_for_tickets, \
+    flight_inventory
+from .utils.manifest import manifest_csv_stream, manifest_tickets
+from .utils.pricing import quote_order, quote_tickets
+from .utils.ticket_documents import get_storage, ticket_document
+from .utils.ticket_seats import flight_free_seats, flight_availability
+from .utils.user_groups import update_group_members
+from .utils.wayforpay import generate_response_signature, SECRET_KEY, decode_order_reference, generate_hmac
+
+logger = logging.getLogger(__name__)
 
 
 class IndexView(LoginRequiredMixin, generic.ListView):
     model = Flight
     template_name = "base_user_interface.html"
     login_url = reverse_lazy('users:login')
+    paginate_by = 20
+
+    def get_search_form(self):
+        if not hasattr(self, 'search_form'):
+            self.search_form = SearchFlightForm(self.request.GET)
+            self.search_form.is_valid()
+        return self.search_form
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data()
         user = self.request.user
         basket = Basket.objects.get(user=user)
         basket_items_count = basket.tickets.count()
-        place_of_departure = self.request.GET.get("place_of_departure", "")
-        place_of_arrival = self.request.GET.get("place_of_arrival", "")
-        context["place_of_departure"] = place_of_departure
-        context["place_of_arrival"] = place_of_arrival
+        search_query = self.request.GET.copy()
+        search_query.pop('page', None)
+        context["search_query"] = search_query.urlencode()
         context['basket_items_count'] = basket_items_count
-        context['search_form'] = SearchFlightForm(
-            initial={
-                "place_of_departure": place_of_departure,
-                "place_of_arrival": place_of_arrival,
-            }
-        )
-
-        flight_tickets = {}
-        check_in_tickets = {}
-        gate_tickets = {}
-        for flight in context['object_list']:
-            tickets_count = Ticket.objects.filter(flight=flight, status='checked_out').count()
-            tickets_check_in = Ticket.objects.filter(flight=flight, status='checked_out',
-                                                     check_in_manager__isnull=False).count()
-            tickets_gate = Ticket.objects.filter(flight=flight, status='checked_out',
-                                                 gate_manager__isnull=False).count()
-            flight_tickets[flight.pk] = tickets_count
-            check_in_tickets[flight.pk] = tickets_check_in
-            gate_tickets[flight.pk] = tickets_gate
-        context['flight_tickets'] = flight_tickets
-        context['check_in_tickets'] = check_in_tickets
-        context['gate_tickets'] = gate_tickets
+        context['search_form'] = self.get_search_form()
         return context
 
     def get_queryset(self):
-        place_of_departure = self.request.GET.get("place_of_departure")
-        place_of_arrival = self.request.GET.get("place_of_arrival")
+        search = self.get_search_form().cleaned_data
 
-        queryset = super().get_queryset()
+        # Ticket counters of every flight on the page come from its statistics rows in the same query
+        queryset = super().get_queryset().annotate(
+            sold_tickets=Coalesce(Sum('seat_inventory__sold'), 0),
+            check_in_tickets=Coalesce(Sum('seat_inventory__checked_in'), 0),
+            gate_tickets=Coalesce(Sum('seat_inventory__boarded'), 0),
+        )
+        return search_flights(
+            queryset,
+            place_of_departure=search.get('place_of_departure'),
+            place_of_arrival=search.get('place_of_arrival'),
+            date_from=search.get('date_from'),
+            date_to=search.get('date_to'),
+        )
 
-        if place_of_departure and place_of_arrival:
-            queryset = queryset.filter(
-                place_of_departure__icontains=place_of_departure,
-                place_of_arrival__icontains=place_of_arrival,
-            )
-        if place_of_departure:
-            queryset = queryset.filter(
-                place_of_departure__icontains=place_of_departure,
-            )
-        if place_of_arrival:
-            queryset = queryset.filter(
-                place_of_arrival__icontains=place_of_arrival,
-            )
 
-        return queryset
+def airport_autocomplete(request):
+    return JsonResponse({'airports': autocomplete_airports(request.GET.get('q', ''))})
+
+
+@transaction.atomic
+def book_ticket(ticket, basket):
+    """Reserves a seat in the flight counters and puts the new ticket into the basket."""
+    reserve_seat(ticket.flight, ticket.seat_class)
+
+    available_ticket = Ticket.objects.filter(
+        flight=ticket.flight,
+        status='available',
+        seat_class=ticket.seat_class
+    ).first()
+    if available_ticket:
+        # If there are available tickets, delete one of them
+        basket_overdue = Basket.objects.filter(tickets=available_ticket).first()
+        if basket_overdue:
+            basket_overdue.messages += f'\nDue to the fact that you did not buy the ticket within 30 minutes and it was bought by another user we have removed Flight: {available_ticket.flight} Seat: {available_ticket.seat_class} from your cart.'
+            basket_overdue.save()
+        available_ticket.delete()
+
+    ticket.save()
+    basket.tickets.add(ticket)
+    transaction.on_commit(lambda: HoldStore().hold(ticket.id))
 
 
 class FlightDetailView(generic.DetailView):
@@ -109,71 +137,35 @@ class FlightDetailView(generic.DetailView):
 
         ticket = Ticket(flight=flight, seat_class=seat_class)
         try:
-            create_ticket_validator(ticket.seat_class, ticket.seat_number, ticket.flight, Ticket)
-            available_tickets = Ticket.objects.filter(
-                flight=ticket.flight,
-                status='available',
-                seat_class=seat_class
-            )
-
-            if available_tickets.exists():
-                available_ticket = available_tickets.first()
-                basket_overdue = Basket.objects.filter(tickets=available_ticket).first()
-                basket_overdue.messages += f'\nDue to the fact that you did not buy the ticket within 30 minutes and it was bought by another user we have removed Flight: {available_ticket.flight} Seat: {available_ticket.seat_class} from your cart.'
-                basket_overdue.save()
-                available_ticket.delete()
-
-            ticket.save()
-            basket.tickets.add(ticket)
-
+            book_ticket(ticket, basket)
         except ValidationError as e:
             error_message = str(e)
-            available_economy_seats = flight.available_economy_seats
-            available_business_seats = flight.available_business_seats
-            total_economy_tickets = Ticket.objects.filter(flight=flight, seat_class='economy',
-                                                          status__in=['booked', 'checked_out']).count()
-            total_business_tickets = Ticket.objects.filter(flight=flight, seat_class='business',
-                                                           status__in=['booked', 'checked_out']).count()
-            available_economy_seats -= total_economy_tickets
-            available_business_seats -= total_business_tickets
-
-            free_economy_seats = free_seats(flight, seat_class='economy')
-            free_business_seats = free_seats(flight, seat_class='business')  # This function returns the set of free spaces in the class
+            availability = flight_availability(flight)
 
             return render(request, self.template_name, {
                 'flight': flight,
                 'error_message': error_message,
-                'available_economy_seats': available_economy_seats,
-                'available_business_seats': available_business_seats,
-                'free_economy_seats': free_economy_seats,
-                'free_business_seats': free_business_seats
+                'available_economy_seats': availability['remaining']['economy'],
+                'available_business_seats': availability['remaining']['business'],
+                'free_economy_seats': availability['free']['economy'],
+                'free_business_seats': availability['free']['business']
             })
 
         return redirect('customer_interface:flight_detail', pk=flight.pk)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        flight = self.get_object()
+        flight = self.object
         user = self.request.user
         basket = Basket.objects.get(user=user)
         basket_items_count = basket.tickets.count()
-        available_economy_seats = flight.available_economy_seats
-        available_business_seats = flight.available_business_seats
-        total_economy_tickets = Ticket.objects.filter(flight=flight, seat_class='economy',
-                                                      status__in=['booked', 'checked_out']).count()
-        total_business_tickets = Ticket.objects.filter(flight=flight, seat_class='business',
-                                                       status__in=['booked', 'checked_out']).count()
-        available_economy_seats -= total_economy_tickets
-        available_business_seats -= total_business_tickets
-
-        free_economy_seats = free_seats(flight, seat_class='economy')
-        free_business_seats = free_seats(flight,
-                                         seat_class='business')  # This function returns the set of free spaces in the class
-
-        context['free_economy_seats'] = free_economy_seats
-        context['free_business_seats'] = free_business_seats
-        context['available_economy_seats'] = available_economy_seats
-        context['available_business_seats'] = available_business_seats
+        # Seats left and free seat numbers of both classes, served from the versioned cache of the flight
+        availability = flight_availability(flight)
+
+        context['free_economy_seats'] = availability['free']['economy']
+        context['free_business_seats'] = availability['free']['business']
+        context['available_economy_seats'] = availability['remaining']['economy']
+        context['available_business_seats'] = availability['remaining']['business']
         context['basket_items_count'] = basket_items_count
         return context
 
@@ -188,30 +180,12 @@ def basket_view(request):
             ticket_form = TicketForm(request.POST)
             if ticket_form.is_valid():
                 ticket = ticket_form.save(commit=False)
-                create_ticket_validator(ticket.seat_class, ticket.seat_number, ticket.flight, Ticket)
-                if ticket.seat_class == 'economy':
-                    # Check if there are already available tickets for this flight
-                    available_tickets = Ticket.objects.filter(
-                        flight=ticket.flight,
-                        status='available',
-                        seat_class='economy'
-                    )
-                else:
-                    available_tickets = Ticket.objects.filter(
-                        flight=ticket.flight,
-                        status='available',
-                        seat_class='business')
-
-                if available_tickets.exists():
-                    # If there are available tickets, delete one of them
-                    available_ticket = available_tickets.first()
-                    basket_overdue = Basket.objects.filter(tickets=available_ticket).first()
-                    basket_overdue.messages += f'\nDue to the fact that you did not buy the ticket within 30 minutes and it was bought by another user we have removed Flight: {available_ticket.flight} Seat: {available_ticket.seat_class} from your cart.'
-                    basket_overdue.save()
-                    available_ticket.delete()
-
-                ticket.save()
-                basket.tickets.add(ticket)
+                try:
+                    book_ticket(ticket, basket)
+                except ValidationError as e:
+                    ticket_form.add_error(None, e)
+                    return render(request, 'customer_interface/basket.html',
+                                  {'tickets': tickets, 'ticket_form': ticket_form})
                 return redirect('customer_interface:basket')
             else:
                 return render(request, 'customer_interface/basket.html',
@@ -283,48 +257,67 @@ def handle_exception(view_func):
     return _wrapped_view
 
 
+@transaction.atomic
+def save_customization(request, order, order_tickets):
+    """Saves the seats, names and facilities of all tickets of the order with a fixed number of queries.
+
+    An order with an outstanding invoice is not changed, the invoice would still be payable at the old price.
+    """
+    # Locked, so a purchase that starts meanwhile waits for the new price
+    payment_status = Order.objects.select_for_update().values_list('payment_status', flat=True).get(id=order.id)
+    if payment_status in ('pending', 'invoiced'):
+        raise ValidationError('This order is waiting for its payment and can no longer be changed')
+    # The statuses are read again under lock, the sweeper or a payment may have changed them since the page loaded
+    statuses = dict(Ticket.objects.select_for_update().filter(
+        id__in=[ticket.id for ticket in order_tickets]).order_by('id').values_list('id', 'status'))
+    order_tickets = [ticket for ticket in order_tickets if ticket.id in statuses]
+    expired_ids = []
+    for ticket in order_tickets:
+        ticket.status = statuses[ticket.id]
+        if ticket.status == 'available':
+            # The booking has expired, so the seat has to be held again before the order can be paid.
+            reserve_seat(ticket.flight, ticket.seat_class)
+            ticket.status = 'booked'
+            expired_ids.append(ticket.id)
+    if expired_ids:
+        Ticket.objects.filter(id__in=expired_ids).update(status='booked', created_at=timezone.now())
+        transaction.on_commit(lambda: HoldStore().hold(*expired_ids))
+
+    # Add new links for the selected amenities, the facilities of all tickets are fetched at once
+    TicketFacilities.objects.bulk_create(selected_facilities(order_tickets, {
+        ticket.id: request.POST.getlist(f'facilities_{ticket.id}') for ticket in order_tickets
+    }))
+
+    seat_requests = []
+    for ticket in order_tickets:
+        seat_number = request.POST.get(f'seat_number_{ticket.id}', None)
+        if seat_number == '':
+            seat_number = None
+        seat_requests.append((ticket, seat_number))
+        ticket.first_name = request.POST.get(f'first_name_{ticket.id}')
+        ticket.last_name = request.POST.get(f'last_name_{ticket.id}')
+    # Every seat of the order is checked against one locked seat map per flight class
+    assign_seats(seat_requests)
+    Ticket.objects.bulk_update(order_tickets, ['seat_number', 'first_name', 'last_name'])
+
+    order.price = quote_order(order)['total']
+    if order.payment_status not in ('paid', 'refund'):
+        # The old invoice no longer matches the order, a new one is requested on the next purchase
+        order.payment_status = 'new'
+        order.invoice_url = ''
+    order.save()
+
+
 @handle_exception
 def ticket_customization(request, order_id):
     order = Order.objects.get(id=order_id)  # Receiving the order
-    order_tickets = order.tickets.all()  # Here I use related_name (tickets) to get all tickets associated with the order.
+    # Here I use related_name (tickets) to get all tickets associated with the order.
+    order_tickets = order.tickets.select_related('flight').prefetch_related(
+        'flight_facilities', 'ticketfacilities_set__flight_facilities',
+    )
 
     if request.method == 'POST':
-        with transaction.atomic():  # Creating a transaction
-            for ticket in order_tickets:
-                facilities_ids = request.POST.getlist(f'facilities_{ticket.id}')
-                # Add new links for the selected amenities
-                for facility_id in facilities_ids:
-                    TicketFacilities.objects.create(
-                        ticket=ticket,
-                        flight_facilities=FlightFacilities.objects.get(id=facility_id),
-                    )
-
-                seat_number = request.POST.get(f'seat_number_{ticket.id}', None)
-                if seat_number == '':
-                    seat_number = None
-                update_ticket_validator(ticket.seat_class, seat_number, ticket.flight, Ticket)
-                ticket.seat_number = seat_number
-                first_name = request.POST.get(f'first_name_{ticket.id}')
-                last_name = request.POST.get(f'last_name_{ticket.id}')
-                ticket.first_name = first_name
-                ticket.last_name = last_name
-                ticket.save()
-
-                if ticket.seat_class == 'economy':
-                    order.price += ticket.flight.price_economy_seats
-                    if ticket.seat_number:
-                        order.price += ticket.flight.price_number_economy_seats
-                else:
-                    order.price += ticket.flight.price_business_seats
-                    if ticket.seat_number:
-                        order.price += ticket.flight.price_number_business_seats
-
-                if ticket.flight_facilities.exists():
-                    for ticket_facility in ticket.ticketfacilities_set.all():
-                        order.price += ticket_facility.flight_facilities.price
-
-                order.save()
-
+        save_customization(request, order, list(order_tickets))
         return redirect('customer_interface:buy_order', order_id=order_id)
 
     # Extract unique flights from the ticket list
@@ -334,13 +327,18 @@ def ticket_customization(request, order_id):
     free_economy_seats = {}
     free_business_seats = {}
     for flight in unique_flights:
-        free_economy_seats = free_seats(flight, seat_class='economy')
-        free_business_seats = free_seats(flight, seat_class='business')
+        free = flight_free_seats(flight)
+        free_economy_seats = free['economy']
+        free_business_seats = free['business']
+
+    # The facilities of all flights of the order are loaded with one query
+    flight_facilities = {}
+    for facility in FlightFacilities.objects.filter(flight__in=unique_flights).select_related('facilities'):
+        flight_facilities.setdefault(facility.flight_id, []).append(facility)
 
     ticket_info = []
     for ticket in order_tickets:
-        flight_facilities = FlightFacilities.objects.filter(flight=ticket.flight)
-        ticket_info.append({'ticket': ticket, 'facilities': flight_facilities})
+        ticket_info.append({'ticket': ticket, 'facilities': flight_facilities.get(ticket.flight_id, [])})
 
     return render(request, 'customer_interface/ticket_customization.html', {
         'order_id': order_id,
@@ -350,18 +348,31 @@ def ticket_customization(request, order_id):
     })
 
 
-@transaction.atomic
+def request_invoice(request, order_id):
+    try:
+        create_invoice.delay(order_id)
+    except Exception:
+        # Without the task nothing would ever leave the pending status, so the order can be bought again at once
+        logger.exception('Could not queue the invoice of order %s', order_id)
+        Order.objects.filter(id=order_id, payment_status='pending').update(payment_status='failed')
+        messages.error(request, 'The payment service is not available right now, please try again.')
+
+
 def buy_order(request, order_id):
     order = Order.objects.get(id=order_id)
     order_tickets = order.tickets.all()
 
     if request.method == 'POST':
-        request_params = create_request_params(order.price, order.user.email, order_tickets.count(), order_id)
-        response = send_request(request_params)
-        result = handle_response(response)
-        print(result)
-
-        return redirect('customer_interface:basket')
+        # Only one invoice request runs per order, the gateway is called from the worker and the page polls for it
+        with transaction.atomic():
+            started = Order.objects.filter(id=order_id, payment_status__in=('new', 'failed')).update(
+                payment_status='pending',
+                payment_requested_at=timezone.now(),
+            )
+            if started:
+                # The task only handles a pending order, so it is queued once the new status is committed
+                transaction.on_commit(lambda: request_invoice(request, order_id))
+        return redirect('customer_interface:buy_order', order_id=order_id)
 
     return render(request, 'customer_interface/buy_order.html', {
         'order': order,
@@ -369,6 +380,23 @@ def buy_order(request, order_id):
     })
 
 
+@login_required
+def ticket_pdf(request, ticket_id):
+    """Streams the stored PDF of a paid ticket, it is rendered only if the ticket changed since the last download."""
+    ticket = get_object_or_404(
+        Ticket.objects.select_related('flight', 'order').prefetch_related('flight_facilities__facilities'),
+        id=ticket_id,
+        status='checked_out',
+    )
+    is_owner = ticket.order is not None and ticket.order.user_id == request.user.id
+    if not is_owner and not request.user.has_perm('customer_interface.view_ticket'):
+        raise Http404
+
+    storage = get_storage()
+    return FileResponse(storage.open(ticket_document([ticket], storage), 'rb'), as_attachment=True,
+                        filename=f'ticket_{ticket.id}.pdf', content_type='application/pdf')
+
+
 class WayForPayCallback(APIView):
     def post(self, request):
         print(request.data)
@@ -387,14 +415,7 @@ class WayForPayCallback(APIView):
         print(order_id)
 
         if code == 1100:
-            order = Order.objects.get(id=order_id)
-            order_tickets = order.tickets.all()
-
-            for ticket in order_tickets:
-                ticket.status = 'checked_out'
-                ticket.save()
-
-                send_tickets.apply_async(args=[ticket.id, ticket.order.user.email])
+            settle_paid_orders([order_id], {order_id: data_dict.get('amount')})
 
         # Отправить ответ WayForPay о принятии заказа
         response_data = {
@@ -428,84 +449,227 @@ def ticket_detail(request, ticket_id):
     user = request.user
     ticket = Ticket.objects.get(id=ticket_id)
     flight = ticket.flight
-    facilities_price = 0
 
     if request.method == 'POST':
+        first_check_in = ticket.check_in_manager_id is None
         ticket.check_in_manager = user
         ticket.time_check = datetime.now()
 
         try:
             with transaction.atomic():
-                facilities_ids = request.POST.getlist(f'facilities_{ticket.id}')
+                # The desk charges the difference between the ticket price after and before the changes
+                price_before = quote_tickets(Ticket.objects.filter(id=ticket.id))['total']
+
                 # Добавляем новые связи только для выбранных удобств
-                for facility_id in facilities_ids:
-                    facilities = TicketFacilities.objects.create(
-                        ticket=ticket,
-                        flight_facilities=FlightFacilities.objects.get(id=facility_id),
-                    )
-                    facilities_price += facilities.flight_facilities.price
+                TicketFacilities.objects.bulk_create(selected_facilities([ticket], {
+                    ticket.id: request.POST.getlist(f'facilities_{ticket.id}'),
+                }))
 
                 seat_number = request.POST.get('seat_number')
                 if seat_number:
-                    update_ticket_validator(ticket.seat_class, seat_number, ticket.flight, Ticket)
-                    ticket.seat_number = seat_number
-                    if ticket.seat_class == 'economy':
-                        facilities_price += ticket.flight.price_number_economy_seats
-                    else:
-                        facilities_price += ticket.flight.price_number_business_seats
+                    assign_seat(ticket, seat_number)
 
                 ticket.save()
+                if first_check_in and ticket.status == 'checked_out':
+                    shift_counters(ticket.flight_id, ticket.seat_class, checked_in=1)
+
+                facilities_price = quote_tickets(Ticket.objects.filter(id=ticket.id))['total'] - price_before
         except ValidationError as e:
             error_message = str(e)
 
             flight_facilities = FlightFacilities.objects.filter(flight=ticket.flight)
 
-            free_economy_seats = free_seats(flight, seat_class='economy')
-            free_business_seats = free_seats(flight, seat_class='business')
+            free = flight_free_seats(flight)
 
             return render(request, 'customer_interface/ticket_detail.html', {
                 'ticket': ticket,
                 'flight_facilities': flight_facilities,
-                'free_economy_seats': free_economy_seats,
-                'free_business_seats': free_business_seats,
+                'free_economy_seats': free['economy'],
+                'free_business_seats': free['business'],
                 'error_message': error_message,
             })
 
-        if facilities_price:
+        if facilities_price > 0:
             FacilitiesOrder.objects.create(
                 ticket=ticket,
                 price=facilities_price
             )
 
-        send_tickets.apply_async(args=[ticket.id, user.email])
+        send_tickets.apply_async(args=[[ticket.id], user.email])
 
         return redirect('customer_interface:ticket_input')
 
     flight_facilities = FlightFacilities.objects.filter(flight=ticket.flight)
     ticket_facility_ids = ticket.flight_facilities.values_list('id', flat=True)
 
-    free_economy_seats = free_seats(flight, seat_class='economy')
-    free_business_seats = free_seats(flight, seat_class='business')
+    free = flight_free_seats(flight)
 
     return render(request, 'customer_interface/ticket_detail.html', {
         'ticket': ticket,
         'flight_facilities': flight_facilities,
         'ticket_facility_ids': ticket_facility_ids,
-        'free_economy_seats': free_economy_seats,
-        'free_business_seats': free_business_seats,
+        'free_economy_seats': free['economy'],
+        'free_business_seats': free['business'],
+    })
+
+
+def desk_tickets(order_id=None, last_name=None):
+    """Paid tickets of the order or of the passengers with the surname, with everything the desk page shows."""
+    tickets = Ticket.objects.filter(status='checked_out')
+    if order_id:
+        tickets = tickets.filter(order_id=order_id)
+    elif last_name:
+        tickets = tickets.filter(last_name__iexact=last_name, flight__date_time_of_departure__gte=timezone.now())
+    else:
+        return []
+    return list(tickets.select_related('flight', 'order').prefetch_related(
+        'flight_facilities__facilities', 'ticketfacilities_set__flight_facilities',
+    ).order_by('flight__date_time_of_departure', 'order_id', 'id'))
+
+
+def _prices_by_order(tickets, ticket_ids):
+    order_of = {ticket.id: ticket.order_id for ticket in tickets}
+    prices = {}
+    for item in quote_tickets(Ticket.objects.filter(id__in=ticket_ids))['items']:
+        order_id = order_of[item['ticket_id']]
+        prices[order_id] = prices.get(order_id, 0) + item['total']
+    return prices
+
+
+@transaction.atomic
+def save_check_in(request, tickets):
+    """Checks in all tickets at once and returns the price of the facilities and seats added at the desk.
+
+    The tickets are locked and their seats and check-in state read again, so two desks checking in the same
+    passengers neither count them twice nor charge them twice. Every order is charged for its own tickets.
+    """
+    ticket_ids = [ticket.id for ticket in tickets]
+    locked = Ticket.objects.select_for_update().filter(id__in=ticket_ids, status='checked_out').values_list(
+        'id', 'seat_number', 'check_in_manager_id')
+    states = {ticket_id: (seat_number, check_in) for ticket_id, seat_number, check_in in locked}
+    if len(states) < len(ticket_ids):
+        raise ValidationError('This ticket is not paid')
+    for ticket in tickets:
+        ticket.seat_number, ticket.check_in_manager_id = states[ticket.id]
+    # The desk charges the difference between the ticket prices after and before the changes
+    prices_before = _prices_by_order(tickets, ticket_ids)
+
+    TicketFacilities.objects.bulk_create(selected_facilities(tickets, {
+        ticket.id: request.POST.getlist(f'facilities_{ticket.id}') for ticket in tickets
+    }))
+    assign_seats([
+        (ticket, request.POST[f'seat_number_{ticket.id}']) for ticket in tickets
+        if not ticket.seat_number and request.POST.get(f'seat_number_{ticket.id}')
+    ])
+
+    first_check_in = [ticket.id for ticket in tickets if ticket.check_in_manager_id is None]
+    now = timezone.now()
+    for ticket in tickets:
+        ticket.check_in_manager = request.user
+        ticket.time_check = now
+    Ticket.objects.bulk_update(tickets, ['seat_number', 'check_in_manager', 'time_check'])
+    if first_check_in:
+        shift_for_tickets(Ticket.objects.filter(id__in=first_check_in), checked_in=1)
+
+    facilities_orders = []
+    for order_id, price in _prices_by_order(tickets, ticket_ids).items():
+        price -= prices_before.get(order_id, 0)
+        if price > 0:
+            order_tickets = [ticket for ticket in tickets if ticket.order_id == order_id]
+            facilities_orders.append(FacilitiesOrder(
+                ticket=order_tickets[0] if len(order_tickets) == 1 else None,
+                order_id=order_id,
+                price=price,
+            ))
+    FacilitiesOrder.objects.bulk_create(facilities_orders)
+    return sum(facilities_order.price for facilities_order in facilities_orders)
+
+
+@permission_required(perm='customer_interface.view_ticket', raise_exception=True)
+def desk_check_in(request):
+    order_id = request.GET.get('order_id', '').strip()
+    last_name = request.GET.get('last_name', '').strip()
+    if order_id and not order_id.isdigit():
+        order_id = None
+    tickets = desk_tickets(order_id, last_name)
+    error_message = None
+
+    if request.method == 'POST' and tickets:
+        try:
+            save_check_in(request, tickets)
+        except ValidationError as e:
+            error_message = e.message
+            # The failed transaction may have changed the loaded tickets, the page shows them as stored
+            tickets = desk_tickets(order_id, last_name)
+        else:
+            send_tickets.apply_async(args=[[ticket.id for ticket in tickets], request.user.email])
+            return redirect('customer_interface:ticket_input')
+
+    # The facilities of all flights on the page are loaded with one query
+    flight_facilities = {}
+    for facility in FlightFacilities.objects.filter(
+            flight__in={ticket.flight_id for ticket in tickets}).select_related('facilities'):
+        flight_facilities.setdefault(facility.flight_id, []).append(facility)
+    flights = {ticket.flight_id: ticket.flight for ticket in tickets}
+    free_seats = {flight_id: flight_free_seats(flight) for flight_id, flight in flights.items()}
+
+    ticket_info = []
+    for ticket in tickets:
+        linked = {link.flight_facilities_id for link in ticket.ticketfacilities_set.all()}
+        ticket_info.append({
+            'ticket': ticket,
+            'facilities': [facility for facility in flight_facilities.get(ticket.flight_id, [])
+                           if facility.id not in linked],
+            'free_seats': sorted(free_seats[ticket.flight_id][ticket.seat_class]),
+        })
+
+    return render(request, 'customer_interface/desk_check_in.html', {
+        'order_id': order_id or '',
+        'last_name': last_name,
+        'ticket_info': ticket_info,
+        'error_message': error_message,
     })
 
 
 @permission_required(perm='customer_interface.add_ticket', raise_exception=True)
 def ticket_gate(request):
-    user = request.user
+    context = {}
     if request.method == 'POST':
-        ticket_id = request.POST.get('ticket_id')
-        ticket = Ticket.objects.get(id=ticket_id)
-        ticket.gate_manager = user
-        ticket.time_gate = datetime.now()
-        ticket.save()
-    return render(request, 'customer_interface/ticket_gate.html')
+        code = request.POST.get('ticket_id', '').strip()
+        try:
+            if code.isdigit():
+                flight_id = Ticket.objects.filter(id=code).values_list('flight_id', flat=True).first()
+            else:
+                flight_id = read_boarding_token(code)[1]
+        except ValidationError as e:
+            flight_id = None
+            context['error_message'] = e.message
+        if flight_id is not None:
+            result = board_scans(flight_id, [{'code': code}], request.user)[0]
+            if result['status'] == 'rejected':
+                context['error_message'] = result['error']
+            else:
+                context['result'] = result
+        elif 'error_message' not in context:
+            context['error_message'] = 'This ticket is not paid'
+    return render(request, 'customer_interface/ticket_gate.html', context)
+
+
+class GateBoardingAPI(APIView):
+    """Boards a batch of scans of one flight, scanners also replay here the scans they queued while offline."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, flight_id):
+        if not request.user.has_perm('customer_interface.add_ticket'):
+            return Response({'detail': 'You do not have permission to board passengers.'}, status=HTTP_403_FORBIDDEN)
+        serializer = GateBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=HTTP_400_BAD_REQUEST)
+        results = board_scans(flight_id, serializer.validated_data['scans'], request.user)
+        return Response({
+            'boarded': sum(result['status'] == 'boarded' for result in results),
+            'results': results,
+        })
 
 
 class CreateFlightView(PermissionRequiredMixin, LoginRequiredMixin, View):
@@ -552,6 +716,7 @@ class UsersList(PermissionRequiredMixin, LoginRequiredMixin, generic.ListView):
     template_name = "customer_interface/users_list.html"
     login_url = reverse_lazy('users:login')
     permission_required = 'customer_interface.add_flight'
+    paginate_by = 50
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data()
@@ -570,7 +735,7 @@ class UsersList(PermissionRequiredMixin, LoginRequiredMixin, generic.ListView):
         email = self.request.GET.get("email")
         queryset = super().get_queryset()
 
-        queryset = queryset.filter(is_superuser=False)
+        queryset = queryset.filter(is_superuser=False).prefetch_related('groups').order_by('email')
 
         if email:
             queryset = queryset.filter(email__icontains=email)
@@ -578,51 +743,90 @@ class UsersList(PermissionRequiredMixin, LoginRequiredMixin, generic.ListView):
         return queryset
 
 
-class SaveUserGroupsView(View):
+class SaveUserGroupsView(PermissionRequiredMixin, LoginRequiredMixin, View):
+    login_url = reverse_lazy('users:login')
+    permission_required = 'customer_interface.add_flight'
+
     def post(self, request, *args, **kwargs):
-        email = request.POST.get("email")
-        check_in_manager_group = Group.objects.get(name='check_in_manager')
-        gate_manager_group = Group.objects.get(name='gate_manager')
-
-        # Получаем списки идентификаторов пользователей для каждой группы
-        check_in_manager_users = request.POST.getlist('check_in_manager_users[]')
-        gate_manager_users = request.POST.getlist('gate_manager_users[]')
-
-        # Получаем объекты пользователей из базы данных
-        users_to_update = get_user_model().objects.filter(is_superuser=False)
-
-        # Обновляем группы пользователей в зависимости от состояния чекбоксов
-        for user in users_to_update:
-            if str(user.id) in check_in_manager_users:
-                # Если чекбокс активен, добавляем пользователя в группу
-                if check_in_manager_group not in user.groups.all():
-                    user.groups.add(check_in_manager_group)
-            else:
-                # Если чекбокс не активен, удаляем пользователя из группы
-                if check_in_manager_group in user.groups.all():
-                    user.groups.remove(check_in_manager_group)
-
-            if str(user.id) in gate_manager_users:
-                # Если чекбокс активен, добавляем пользователя в группу
-                if gate_manager_group not in user.groups.all():
-                    user.groups.add(gate_manager_group)
-            else:
-                # Если чекбокс не активен, удаляем пользователя из группы
-                if gate_manager_group in user.groups.all():
-                    user.groups.remove(gate_manager_group)
+        email = request.POST.get("email", "")
+        page = request.POST.get("page", "")
+        groups = Group.objects.in_bulk(['check_in_manager', 'gate_manager'], field_name='name')
+
+        def submitted_ids(name):
+            return {int(pk) for pk in request.POST.getlist(name) if pk.isdigit()}
+
+        # Only the users shown on the saved page are updated, a checkbox that is not sent means "not a member"
+        shown_users = set(get_user_model().objects.filter(
+            id__in=submitted_ids('shown_users[]'), is_superuser=False,
+        ).values_list('id', flat=True))
+        update_group_members(shown_users, {
+            groups['check_in_manager']: submitted_ids('check_in_manager_users[]'),
+            groups['gate_manager']: submitted_ids('gate_manager_users[]'),
+        })
 
-        return HttpResponseRedirect(reverse('customer_interface:users_list') + "?email=" + email)
+        query = urlencode({'email': email, **({'page': page} if page.isdigit() else {})})
+        return HttpResponseRedirect(reverse('customer_interface:users_list') + "?" + query)
 
 
 @permission_required(perm='customer_interface.view_flight', raise_exception=True)
 def flight_stats(request, pk):
     flight = get_object_or_404(Flight, pk=pk)
-    tickets = Ticket.objects.filter(flight=flight)
-    total_economy_tickets = Ticket.objects.filter(flight=flight, seat_class='economy', status='checked_out').count()
-    total_business_tickets = Ticket.objects.filter(flight=flight, seat_class='business', status='checked_out').count()
+    # One joined query for the whole manifest, split by class here instead of iterating it twice in the template
+    tickets = {'economy': [], 'business': []}
+    for ticket in manifest_tickets(flight=flight):
+        tickets[ticket.seat_class].append(ticket)
+    statistics = flight_inventory(flight)
     return render(request, 'customer_interface/flight_stats.html', {
         'flight': flight,
-        'tickets': tickets,
-        'total_economy_tickets': total_economy_tickets,
-        'total_business_tickets': total_business_tickets,
+        'economy_tickets': tickets['economy'],
+        'business_tickets': tickets['business'],
+        'statistics': statistics,
+        'total_economy_tickets': statistics['economy'].sold,
+        'total_business_tickets': statistics['business'].sold,
     })
+
+
+@permission_required(perm='customer_interface.view_flight', raise_exception=True)
+def manifest_csv(request, pk=None, day=None):
+    """Streams the manifest of the flight, or of every flight departing on the day, as CSV."""
+    if pk is not None:
+        flight = get_object_or_404(Flight, pk=pk)
+        filters, file_name = {'flight': flight}, f'manifest_flight_{flight.pk}.csv'
+    else:
+        try:
+            date = parse_date(day)
+        except ValueError:  # Well formed, but not a real date
+            date = None
+        if date is None:
+            raise Http404
+        filters, file_name = {'flight__date_time_of_departure__date': date}, f'manifest_{date}.csv'
+    response = StreamingHttpResponse(manifest_csv_stream(**filters), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    return response
+
+
+async def flight_events(request):
+    """Streams the sold, checked-in and boarded counters of the flights as server-sent events, served over ASGI.
+
+    The flights come from the repeated `flight` parameter, without it the stream covers the next day's departures.
+    """
+    if not await sync_to_async(lambda: request.user.has_perm('customer_interface.view_flight'))():
+        raise PermissionDenied
+    flight_ids = {int(pk) for pk in request.GET.getlist('flight') if pk.isdigit()}
+    if not flight_ids:
+        now = timezone.now()
+        flight_ids = {pk async for pk in Flight.objects.filter(
+            date_time_of_departure__range=(now, now + timedelta(days=1)),
+        ).values_list('pk', flat=True)}
+
+    async def load_snapshot():
+        snapshot = {}
+        async for row in SeatInventory.objects.filter(flight_id__in=flight_ids).values(
+                'flight_id', 'seat_class', 'capacity', 'sold', 'checked_in', 'boarded'):
+            snapshot.setdefault(row.pop('flight_id'), {})[row.pop('seat_class')] = row
+        return snapshot
+
+    response = StreamingHttpResponse(flight_event_stream(flight_ids, load_snapshot), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx passes every event on as soon as it arrives
+    return response
@@ -6,21 +6,6 @@ from django import template
 register = template.Library()
 
 
-@register.filter
-def flight_ticket_value(flight_tickets, flight_pk):
-    return flight_tickets.get(flight_pk, 0)
-
-
-@register.filter
-def check_in_tickets_value(check_in_tickets, flight_pk):
-    return check_in_tickets.get(flight_pk, 0)
-
-
-@register.filter
-def gate_tickets_value(gate_tickets, flight_pk):
-    return gate_tickets.get(flight_pk, 0)
-
-
 @register.filter
 def time_until_now(time_arg):
     if isinstance(time_arg, str):
@@ -1,29 +1,26 @@
-from django.contrib.sites.shortcuts import get_current_site
-
-from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 
+from customer_interface.utils.mail_queue import queue_email
 from users.utils.token_generators import TokenGenerator
 
 
-def send_registration_email(request, user_instance):
+def send_registration_email(domain, user_instance):
     message = render_to_string(
         'emails/registration_email.html',
         context={
             'user': user_instance,
-            'domain': get_current_site(request),
+            'domain': domain,
             'uid': urlsafe_base64_encode(force_bytes(user_instance.pk)),
             'token': TokenGenerator().make_token(user_instance)
         }
     )
 
-    email = EmailMessage(
+    queue_email(
         subject="Activate your account",
         body=message,
         to=[user_instance.email],
+        content_subtype='html',
     )
-    email.content_subtype = 'html'
-    email.send()
     
\ No newline at end of file
@@ -0,0 +1,13 @@
+from celery import shared_task
+from django.contrib.auth import get_user_model
+
+from users.services.emails import send_registration_email
+
+
+@shared_task
+def send_activation_email(user_id, domain):
+    """Renders the activation email of a new user, the token is made here so it matches the user at send time."""
+    user = get_user_model().objects.filter(pk=user_id, is_active=False).first()
+    if user is None:
+        return  # Already activated or deleted
+    send_registration_email(domain, user)
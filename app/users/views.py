@@ -1,6 +1,8 @@
 from django.contrib.auth import authenticate, login, logout, get_user_model
 from django.contrib.auth.models import User
 from django.contrib.auth.views import LoginView, LogoutView
+from django.contrib.sites.shortcuts import get_current_site
+from django.db import transaction
 from django.http import HttpResponse
 from django.shortcuts import render, redirect
 from django.urls import reverse, reverse_lazy
@@ -9,7 +11,7 @@ from django.utils.http import urlsafe_base64_decode
 from django.views.generic import CreateView, RedirectView, TemplateView
 
 from users.forms import UserRegistrationForm
-from users.services.emails import send_registration_email
+from users.tasks import send_activation_email
 
 from users.utils.token_generators import TokenGenerator
 
@@ -28,11 +30,9 @@ class UserRegistrationView(CreateView):
         self.object = form.save(commit=False)
         self.object.is_active = False
         self.object.save()
-        # send email or sms notification
-        send_registration_email(
-            request=self.request,
-            user_instance=self.object
-        )
+        # send email or sms notification from the worker, once the user row is committed
+        user_id, domain = self.object.pk, get_current_site(self.request).domain
+        transaction.on_commit(lambda: send_activation_email.delay(user_id, domain))
         return super().form_valid(form)
 
 